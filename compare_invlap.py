@@ -0,0 +1,39 @@
+from ttim import *
+from scipy.special import exp1
+import time
+
+######################################################
+# Compares the accuracy and speed of the de Hoog inversion
+# with the linear inversion (invmethod='linear')
+######################################################
+
+# Accuracy: Theis well in a single aquifer compared to the exact solution
+T, S, Q = 10.0, 1e-3, 100.0
+t = np.logspace(-2,1,31)
+print 'Theis well, max abs error in head'
+print '%6s %12s %12s %12s %12s' % ('r','dehoog','linear','dehoog M=10','linear M=10')
+for r in [1.0,10.0,50.0]:
+    exact = -Q / (4*np.pi*T) * exp1( r**2 * S / (4*T*t) )
+    err = []
+    for M in [20,10]:
+        for method in ['dehoog','linear']:
+            ml = ModelMaq(kaq=[T],z=[1,0],Saq=[S],tmin=1e-2,tmax=10,M=M,invmethod=method)
+            w = DischargeWell(ml,xw=0,yw=0,rw=1e-3,tsandQ=[(0,Q)],layers=1)
+            ml.solve()
+            err.append( np.max(np.abs( ml.head(r,0,t)[0] - exact )) )
+    print '%6.1f %12.3e %12.3e %12.3e %12.3e' % (r,err[0],err[1],err[2],err[3])
+
+# Speed: grid of heads in a two-aquifer model with a number of wells and a line-sink
+print
+print 'Two-aquifer model, 40 x 40 grid at 5 times'
+h = {}
+for method in ['dehoog','linear']:
+    ml = ModelMaq(kaq=[10,5],z=[4,2,1,0],c=[100],Saq=[1e-3,1e-4],Sll=[1e-6],tmin=0.1,tmax=10,M=20,invmethod=method)
+    for i in range(10):
+        DischargeWell(ml,xw=10*np.cos(i),yw=10*np.sin(i),rw=0.1,tsandQ=[(0,50),(5,20)],layers=1+i%2)
+    HeadLineSink(ml,x1=-20,y1=-15,x2=20,y2=-12,tsandh=[(0,1)],layers=1)
+    ml.solve()
+    t0 = time.time()
+    h[method] = ml.headgrid(-30,30,40,-30,30,40,[0.5,1,2,5,8])
+    print '%8s %8.3f seconds' % (method,time.time()-t0)
+print 'max abs difference in grid heads', np.max(np.abs(h['dehoog']-h['linear']))
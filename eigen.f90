@@ -0,0 +1,114 @@
+!Copyright (C), 2010, Mark Bakker.
+!Module for the eigen decomposition of the complex symmetric tridiagonal system matrices
+!eigen.f90 is part of the TTim program and is distributed under the MIT license
+
+module tridiageigen
+
+contains
+
+    subroutine tridiageig( d, e, n, w, z, info )
+
+        ! eigenvalues w and eigenvectors z (columns) of the complex symmetric tridiagonal matrix
+        ! with diagonal d and off-diagonal e; implicit QL iterations with complex rotations.
+        ! the rotations are complex orthogonal, so transpose(z) z = I and the inverse of z is its transpose.
+        ! info = 1 when the iteration does not converge or a rotation is (nearly) isotropic
+
+        implicit none
+        complex(kind=8), intent(in), dimension(n) :: d
+        complex(kind=8), intent(in), dimension(n-1) :: e
+        integer, intent(in) :: n
+        complex(kind=8), intent(out), dimension(n) :: w
+        complex(kind=8), intent(out), dimension(n,n) :: z
+        integer, intent(out) :: info
+
+        complex(kind=8), dimension(n) :: ee
+        complex(kind=8) :: b, c, f, g, p, r, s, zk
+        real(kind=8) :: eps
+        integer :: i, k, l, m, iter
+
+        eps = epsilon(1.d0)
+        info = 0
+        w = d
+        ee(1:n-1) = e
+        ee(n) = cmplx(0.d0,0.d0,kind=8)
+        z(:,:) = cmplx(0.d0,0.d0,kind=8)
+        do i = 1, n
+            z(i,i) = cmplx(1.d0,0.d0,kind=8)
+        end do
+
+        do l = 1, n
+            iter = 0
+            do
+                do m = l, n-1  ! look for a negligible off-diagonal element
+                    if ( abs(ee(m)) <= eps * ( abs(w(m)) + abs(w(m+1)) ) ) exit
+                end do
+                if ( m == l ) exit
+                if ( iter == 50 ) then
+                    info = 1
+                    return
+                endif
+                iter = iter + 1
+                ! shift from the leading 2x2 block
+                g = ( w(l+1) - w(l) ) / ( 2.d0 * ee(l) )
+                r = sqrt( g * g + 1.d0 )
+                if ( abs(g-r) > abs(g+r) ) r = -r
+                g = w(m) - w(l) + ee(l) / ( g + r )
+                s = cmplx(1.d0,0.d0,kind=8)
+                c = cmplx(1.d0,0.d0,kind=8)
+                p = cmplx(0.d0,0.d0,kind=8)
+                do i = m-1, l, -1
+                    f = s * ee(i)
+                    b = c * ee(i)
+                    r = sqrt( f * f + g * g )
+                    if ( abs(r) <= 1.d-8 * ( abs(f) + abs(g) ) ) then  ! c*c+s*s=1 cannot be scaled
+                        info = 1
+                        return
+                    endif
+                    ee(i+1) = r
+                    s = f / r
+                    c = g / r
+                    g = w(i+1) - p
+                    r = ( w(i) - g ) * s + 2.d0 * c * b
+                    p = s * r
+                    w(i+1) = g + p
+                    g = c * r - b
+                    do k = 1, n
+                        zk = z(k,i+1)
+                        z(k,i+1) = s * z(k,i) + c * zk
+                        z(k,i) = c * z(k,i) - s * zk
+                    end do
+                end do
+                w(l) = w(l) - p
+                ee(l) = g
+                ee(m) = cmplx(0.d0,0.d0,kind=8)
+            end do
+        end do
+
+    end subroutine tridiageig
+
+    subroutine tridiageigv( d, e, n, np, w, z, info )
+        !f2py threadsafe
+
+        ! decomposes a stack of np tridiagonal matrices in one call; see tridiageig
+
+        implicit none
+        complex(kind=8), intent(in), dimension(np,n) :: d
+        complex(kind=8), intent(in), dimension(np,n-1) :: e
+        integer, intent(in) :: n, np
+        complex(kind=8), intent(out), dimension(np,n) :: w
+        complex(kind=8), intent(out), dimension(np,n,n) :: z
+        integer, intent(out), dimension(np) :: info
+
+        complex(kind=8), dimension(n) :: wp
+        complex(kind=8), dimension(n,n) :: zp
+        integer :: ip
+
+        do ip = 1, np
+            call tridiageig( d(ip,:), e(ip,:), n, wp, zp, info(ip) )
+            w(ip,:) = wp
+            z(ip,:,:) = zp
+        end do
+
+    end subroutine tridiageigv
+
+end module tridiageigen
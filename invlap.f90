@@ -28,17 +28,26 @@ contains
         integer, intent(in) :: M, Nt
         real(kind=8), intent(in) :: gamma
         real(kind=8), dimension(Nt) :: ft
+        
+        ft = invlapeval( t, tmin, tmax, invlapcoef( fp, M ), M, gamma, Nt )
+    
+    end function invlap
+    
+    function invlapcoef( fp, M ) result (d)
+    
+        ! returns the continued fraction coefficients d; they only depend on fp
+        ! a series that contains a zero returns all zero coefficients, which evaluate to zero
+
+        complex(kind=8), intent(in), dimension(0:2*M) :: fp
+        integer, intent(in) :: M
+        complex(kind=8), dimension(0:2*M) :: d
     
         complex(kind=8), dimension(0:2*M,0:M) :: e
         complex(kind=8), dimension(0:2*M-1,0:M) :: q  ! column 0 is not used
-        complex(kind=8), dimension(0:2*M) :: d
-        complex(kind=8), dimension(0:2*M+1,Nt) :: A,B
-        complex(kind=8), dimension(Nt) :: z,h2M,R2Mz
-        integer :: r, rq, n, M
-        real(kind=8) :: pi, bigt
-            
-        pi = 3.1415926535897931d0
-        bigt = 2.d0 * tmax
+        integer :: r, rq
+        
+        d(:) = cmplx(0.d0,0.d0,kind=8)
+        if ( any( fp == cmplx(0.d0,0.d0,kind=8) ) ) return
 
         !a[0] = a[0] / 2.0  # zero term is halved
     
@@ -58,10 +67,36 @@ contains
         end do
     
         ! build up d vector (index shift: 1)
-        d(:) = cmplx(0.d0,0.d0,kind=8)
         d(0) = fp(0)/2.0 ! half first term
         d(1:2*M-1:2) = -q(0,1:M) ! these 2 lines changed after niclas
         d(2:2*M:2) = -e(0,1:M) 
+        
+    end function invlapcoef
+    
+    function invlapeval( t, tmin, tmax, d, M, gamma, Nt ) result (ft)
+        !f2py threadsafe
+    
+        ! evaluates the continued fraction with coefficients d (from invlapcoef) at times t
+
+        real(kind=8), intent(in), dimension(Nt) :: t   ! vector of times
+        real(kind=8), intent(in) :: tmin, tmax
+        complex(kind=8), intent(in), dimension(0:2*M) :: d
+        integer, intent(in) :: M, Nt
+        real(kind=8), intent(in) :: gamma
+        real(kind=8), dimension(Nt) :: ft
+    
+        complex(kind=8), dimension(0:2*M+1,Nt) :: A,B
+        complex(kind=8), dimension(Nt) :: z,h2M,R2Mz
+        integer :: n
+        real(kind=8) :: pi, bigt
+            
+        pi = 3.1415926535897931d0
+        bigt = 2.d0 * tmax
+        
+        if ( d(0) == cmplx(0.d0,0.d0,kind=8) ) then  ! series with a zero item
+            ft(:) = 0.d0
+            return
+        endif
     
         ! build A and B vectors (Hollenbeck claims an index shift of 2, but that may be related to the matlab code)
         ! now make into matrices, one row for each time
@@ -87,7 +122,63 @@ contains
         ! inversion
         ft = ( 1.d0/bigt * exp(gamma*t) * real( A(2*M+1,:) / B(2*M+1,:) ) )        
     
-    end function invlap
+    end function invlapeval
+    
+    function invlapv( t, tmin, tmax, fp, M, gamma, nt, Nf, Ntmax ) result (ft)
+    
+        ! inverts a stack of Nf series in one call; series k is inverted at times t(k,1:nt(k))
+        ! a series that contains a zero returns zero (same check as done in python before)
+
+        real(kind=8), intent(in), dimension(Nf,Ntmax) :: t   ! times for each series, padded to Ntmax
+        real(kind=8), intent(in) :: tmin, tmax
+        complex(kind=8), intent(in), dimension(Nf,0:2*M) :: fp
+        integer, intent(in) :: M, Nf, Ntmax
+        integer, intent(in), dimension(Nf) :: nt  ! number of times used for each series
+        real(kind=8), intent(in) :: gamma
+        real(kind=8), dimension(Nf,Ntmax) :: ft
+        
+        ft = invlapevalv( t, tmin, tmax, invlapcoefv( fp, M, Nf ), M, gamma, nt, Nf, Ntmax )
+        
+    end function invlapv
+    
+    function invlapcoefv( fp, M, Nf ) result (d)
+        !f2py threadsafe
+    
+        ! continued fraction coefficients for a stack of Nf series
+
+        complex(kind=8), intent(in), dimension(Nf,0:2*M) :: fp
+        integer, intent(in) :: M, Nf
+        complex(kind=8), dimension(Nf,0:2*M) :: d
+        integer :: k
+        
+        do k = 1, Nf
+            d(k,:) = invlapcoef( fp(k,:), M )
+        end do
+        
+    end function invlapcoefv
+    
+    function invlapevalv( t, tmin, tmax, d, M, gamma, nt, Nf, Ntmax ) result (ft)
+        !f2py threadsafe
+    
+        ! evaluates a stack of Nf coefficient vectors; series k at times t(k,1:nt(k))
+
+        real(kind=8), intent(in), dimension(Nf,Ntmax) :: t   ! times for each series, padded to Ntmax
+        real(kind=8), intent(in) :: tmin, tmax
+        complex(kind=8), intent(in), dimension(Nf,0:2*M) :: d
+        integer, intent(in) :: M, Nf, Ntmax
+        integer, intent(in), dimension(Nf) :: nt  ! number of times used for each series
+        real(kind=8), intent(in) :: gamma
+        real(kind=8), dimension(Nf,Ntmax) :: ft
+        integer :: k
+        
+        ft(:,:) = 0.d0
+        do k = 1, Nf
+            if ( nt(k) > 0 ) then
+                ft(k,1:nt(k)) = invlapeval( t(k,1:nt(k)), tmin, tmax, d(k,:), M, gamma, nt(k) )
+            end if
+        end do
+        
+    end function invlapevalv
   
 end module invlaptrans
 
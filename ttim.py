@@ -7,16 +7,70 @@ import numpy as np
 import matplotlib.pyplot as plt
 from bessel import *
 from invlap import *
+from eigen import *
 from scipy.special import kv,iv # Needed for K1 in Well class, and in CircInhom
-from cmath import tanh as cmath_tanh
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 import inspect # Used for storing the input
 import os
+import mmap
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import threading
+import collections
 from mathieu_functions import mathieu
 
 __version__ = 0.23
 
+def assemblerows(mat,rhs,e,ieq):
+    '''Fills the rows of element e, starting at row ieq, in mat[Np,Neq,Neq] and rhs[Np,Neq,Ngvbc]'''
+    emat, erhs = e.equation()
+    mat[ :, ieq:ieq+e.Nunknowns, : ] = emat.transpose(2,0,1)
+    rhs[ :, ieq:ieq+e.Nunknowns, : ] = erhs.transpose(2,0,1)
+
+forkassembly = {}  # mat, rhs and row blocks of TimModel.assemble; inherited by the forked workers
+def forkassemblerows(i):
+    e,ieq = forkassembly['blocks'][i]
+    assemblerows(forkassembly['mat'],forkassembly['rhs'],e,ieq)
+
+forksolve = {}  # model, solution, solver and Laplace parameters of TimModel.solveintervals; inherited by the forked workers
+def forksolveinterval(n):
+    ml = forksolve['model']
+    # Worker becomes a model with one interval; always sliced from the full arrays as a worker may get several intervals
+    ml.setinterval(n,forksolve['p'],forksolve['gamma'],forksolve['tintervals'],forksolve['dpdtheta'])
+    ml.initialize()
+    forksolve['sol'][n*ml.Npin:(n+1)*ml.Npin] = ml.solvematrix(forksolve['solver'],forksolve['tol'])
+
+forkgrid = {}  # model, grid and h of TimModel.headgrid2; inherited by the forked workers
+def forkheadtile(tile):
+    forkgrid['model'].headtile(forkgrid['h'],forkgrid['xg'],forkgrid['yg'],forkgrid['t'],forkgrid['layers'],tile)
+
+class InvLapCache:
+    '''Coefficients of the inverse of TimModel.potential and Element.strength by key.
+    Only the model.maxcache most recently used entries are kept; maxcache=0 switches the cache off'''
+    def __init__(self,model):
+        self.model = model
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()  # potential may be called from several threads, see potentialv
+    def __len__(self):
+        return len(self.data)
+    def get(self,key):
+        with self.lock:
+            d = self.data.pop(key,None)
+            if d is not None: self.data[key] = d  # Most recently used is last
+        return d
+    def put(self,key,d):
+        with self.lock:
+            self.data.pop(key,None)
+            self.data[key] = d
+            while len(self.data) > max(self.model.maxcache,0):
+                self.data.popitem(last=False)
+
 class TimModel:
-    def __init__(self,kaq=[1,1],Haq=[1,1],c=[1e100,100],Saq=[0.3,0.003],Sll=[0],topboundary='imp',tmin=1,tmax=10,M=20):
+    def __init__(self,kaq=[1,1],Haq=[1,1],c=[1e100,100],Saq=[0.3,0.003],Sll=[0],topboundary='imp',tmin=1,tmax=10,M=20,invmethod='dehoog'):
+        '''invmethod is 'dehoog' (default) or 'linear'. With 'linear' the p values are chosen on a fixed
+        parabolic contour for each interval and the inverse is a matrix product with precomputed weights'''
         self.elementList = []
         self.elementDict = {}
         self.vbcList = []  # List with variable boundary condition 'v' elements
@@ -25,24 +79,117 @@ class TimModel:
         self.tmin = float(tmin)
         self.tmax = float(tmax)
         self.M = M
+        self.invmethod = invmethod
+        self.maxcache = 1000  # Maximum number of points and elements of which the inverse is stored, see InvLapCache
         self.aq = Aquifer(self,kaq,Haq,c,Saq,Sll,topboundary)
         self.compute_laplace_parameters()
         self.name = 'TimModel'
+        self.groupgiven = True  # Given elements with proportional bc share a column, see groupgivenelements
+        self.lufactors = None  # LU factors of every p, stored when solving with keepfactors=1
+        self.pinitialized = None  # Laplace parameters of the last initialization
+        self.assembled = None  # mat, rhs and their layout of the last solve with incremental=1
+        self.inhomfactors = None  # Inhomogeneity block and its LU factors of every p of the last solve with solver='schur'
+        self.elementindex = None  # Boxes of the reach of the elements, see setelementindex
+        self.elementorder = None  # elementList and the position of its elements, see equationblocks
         self.modelname = 'ml' # Used for writing out input
         bessel.initialize()
     def __repr__(self):
         return 'Model'
-    def initialize(self):
-        self.gvbcList = self.gbcList + self.vbcList
+    def initialize(self,incremental=False):
+        '''With incremental=True only the aquifers and elements that changed since the previous initialization
+        (see AquiferData.set and Element.set) and the elements in a changed aquifer are initialized again.
+        The elements that are initialized are stored in dirty'''
+        self.groupgivenelements()
+        self.gvbcList = self.gbcGroupList + self.vbcList
         self.vzbcList = self.vbcList + self.zbcList
         self.elementList = self.gbcList + self.vbcList + self.zbcList  # Given elements are first in list
-        self.Ngbc = len(self.gbcList)
+        self.Ngbc = len(self.gbcGroupList)  # Number of given bc columns, not number of given elements
         self.Nvbc = len(self.vbcList)
         self.Nzbc = len(self.zbcList)
         self.Ngvbc = self.Ngbc + self.Nvbc
-        self.aq.initialize()
-        for e in self.elementList:
-            e.initialize()
+        self.invlapcache = InvLapCache(self)
+        aqlist = [self.aq] + self.aq.inhomList
+        # New Laplace parameters or a new inhomogeneity (which changes the aquifer of elements) require everything
+        if incremental and (self.pinitialized is self.p) and np.all([ hasattr(aq,'eigval') for aq in aqlist ]):
+            aqchanged = [ aq for aq in aqlist if aq.changed ]
+            for aq in aqchanged:
+                if aq is self.aq:
+                    AquiferData.initialize(aq)  # Background only, not the inhomogeneities
+                else:
+                    aq.initialize()
+            self.dirty = []
+            for e in self.elementList:
+                if e.changed or np.any([ getattr(e,name,None) in aqchanged for name in ['aq','aqin','aqout'] ]):
+                    e.initialize()
+                    self.dirty.append(e)
+                elif (e.type != 'g') and (len(e.parameters) != self.Ngvbc):  # Given elements have no parameters
+                    e.parameters = np.zeros( (self.Ngvbc,) + e.parameters.shape[1:], 'D' )
+        else:
+            self.aq.initialize()
+            for e in self.elementList:
+                e.initialize()
+            self.dirty = list(self.elementList)
+        for aq in aqlist: aq.changed = False
+        for e in self.elementList: e.changed = False
+        self.pinitialized = self.p
+        self.elementindex = None
+    def setelementindex(self):
+        '''Stores elementindex = (boxgbc,boxvzbc) with the boxes (xmin,xmax,ymin,ymax) of the reach of
+        the elements in gbcGroupList and vzbcList, see Element.reach. The influence of an element is zero
+        beyond Rzero times the largest abs(lab) of its aquifer, so it is only computed for points inside its box.
+        Elements without reach get an infinite box'''
+        everywhere = (-np.inf,np.inf,-np.inf,np.inf)
+        self.elementindex = tuple( np.array([ e.reach() or everywhere for e in elist ],'d').reshape(-1,4)
+                                   for elist in [self.gbcGroupList,self.vzbcList] )
+    def reaching(self,boxes,x,y):
+        '''Returns list of (i,ind) for the boxes i that contain some of the points x,y;
+        ind is an index array of those points or slice(None) when the box contains all points'''
+        inbox = (boxes[:,0] <= x.max()) & (boxes[:,1] >= x.min()) & (boxes[:,2] <= y.max()) & (boxes[:,3] >= y.min())
+        rv = []
+        for i in np.nonzero(inbox)[0]:
+            xmin,xmax,ymin,ymax = boxes[i]
+            inside = (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax)
+            if np.all(inside):
+                rv.append( (i,slice(None)) )
+            elif np.any(inside):
+                rv.append( (i,np.nonzero(inside)[0]) )
+        return rv
+    def groupgivenelements(self):
+        '''Given elements with the same tstart and proportional bc share one column of the right-hand side
+        gbcGroupList contains an element when it is alone, otherwise a GivenElementGroup
+        No groups are formed when groupgiven is False, so that set_schedule works for every given element'''
+        groups = []  # list of [tstart, bc, elements, scales]
+        for e in self.gbcList:
+            e.setbc()
+            if not self.groupgiven:
+                groups.append( [e.tstart, e.bc, [e], [1.0]] )
+                continue
+            for g in groups:
+                if len(g[0]) == len(e.tstart) and np.all(g[0] == e.tstart):
+                    ibc = np.argmax(np.abs(g[1]))
+                    if g[1][ibc] == 0.0: continue
+                    scale = e.bc[ibc] / g[1][ibc]
+                    if np.allclose(e.bc, scale * g[1], rtol=1e-12, atol=0.0):
+                        g[2].append(e); g[3].append(scale)
+                        break
+            else:
+                groups.append( [e.tstart, e.bc, [e], [1.0]] )
+        self.gbcGroupList = []
+        for tstart,bc,elements,scales in groups:
+            if len(elements) == 1:
+                self.gbcGroupList.append(elements[0])
+            else:
+                self.gbcGroupList.append( GivenElementGroup(self,tstart,bc,elements,scales) )
+    def set_schedule(self,label,tsandbc):
+        '''Changes tsandQ or tsandh of the given or variable element with label without solving again.
+        The solution is computed for a unit bc; the tstart and bc values are only used in the inversion'''
+        assert label in self.elementDict, "TTim error: no element with label "+str(label)
+        e = self.elementDict[label]
+        assert e.type in ['g','v'], "TTim error: schedule can only be changed for elements with a given or variable bc"
+        if hasattr(self,'gvbcList'):  # Model is solved
+            assert e.type == 'v' or e in self.gbcGroupList, "TTim error: element "+str(label)+" shares a column with other given elements; set groupgiven=False before solving"
+        e.settsandbc(tsandbc)
+        e.setbc()
     def addElement(self,e):
         if e.label is not None: self.elementDict[e.label] = e
         if e.type == 'g':
@@ -53,12 +200,15 @@ class TimModel:
             self.zbcList.append(e)
     def addInhom(self,inhom):
         self.aq.inhomList.append(inhom)
+        self.aq.inhomindex = None
     def compute_laplace_parameters(self):
         '''
         Nin: Number of time intervals
         Npin: Number of p values per interval
         Np: Total number of p values (Nin*Np)
         p[Np]: Array with p values
+        For invmethod 'linear' the p values of interval n are on the parabolic contour of
+        Trefethen, Weideman and Schmelzer (2006) scaled to the geometric mean of the interval
         '''
         itmin = np.floor(np.log10(self.tmin))
         itmax = np.ceil(np.log10(self.tmax))
@@ -74,64 +224,84 @@ class TimModel:
         run = np.arange(2*self.M+1)  # so there are 2M+1 terms in Fourier series expansion
         self.p = []
         self.gamma = []
+        self.dpdtheta = []  # Only used for invmethod 'linear'
+        theta = np.pi * run / (2*self.M+1)
         for i in range(self.Nin):
             T = self.tintervals[i+1] * 2.0
             gamma = alpha - np.log(tol) / (T/2.0)
-            p = gamma + 1j * np.pi * run / T
+            if self.invmethod == 'linear':
+                td = np.sqrt( self.tintervals[i] * self.tintervals[i+1] )
+                N = 2*self.M+1
+                p = N / td * ( 0.1309 - 0.1194 * theta**2 + 0.25j * theta )
+                self.dpdtheta.extend( ( N / td * ( -0.2388 * theta + 0.25j ) ).tolist() )
+            else:
+                p = gamma + 1j * np.pi * run / T
             self.p.extend( p.tolist() )
             self.gamma.append(gamma)
         self.p = np.array(self.p)
         self.gamma = np.array(self.gamma)
+        self.dpdtheta = np.array(self.dpdtheta)
         self.Np = len(self.p)
         self.Npin = 2 * self.M + 1
+        self.invlapweightscache = {}
+        self.invlapcache = InvLapCache(self)  # Coefficients of inverse, reset when solving
         self.aq.initialize()
-    def potential(self,x,y,t,pylayers=None,aq=None,derivative=0,returnphi=0):
+    def potential(self,x,y,t,pylayers=None,aq=None,derivative=0,returnphi=0,workers=1):
         '''Returns pot[Naq,Ntimes] if layers=None, otherwise pot[len(pylayers,Ntimes)]
-        t must be ordered '''
+        t may be unordered and contain duplicates; workers as in potentialv '''
         if aq is None: aq = self.aq.findAquiferData(x,y)
+        if returnphi: return self.potentialv(x,y,t,pylayers,aq,derivative,returnphi,workers)[...,0]
+        if pylayers is None: pylayers = range(aq.Naq)
+        # Coefficients of the inverse are stored so that the same point can be computed for other times quickly
+        key = ('potential',float(x),float(y),aq,tuple(pylayers),derivative)
+        d = self.invlapcache.get(key)
+        if d is None:
+            pot = self.potentialv(x,y,t,pylayers,aq,derivative,returnphi=1,workers=workers)[...,0]
+            d = self.invlapprepare(pot)
+            self.invlapcache.put(key,d)
+        time = np.atleast_1d(t).copy()
+        if (time.min() < self.tmin) or (time.max() > self.tmax): print 'Warning, some of the times are smaller than tmin or larger than tmax; zeros are substituted'
+        return self.inverseLapTranGvbc(None,time,d)
+    def potentialv(self,x,y,t,pylayers=None,aq=None,derivative=0,returnphi=0,workers=1):
+        '''Returns pot[Naq,Ntimes,Npts] if layers=None, otherwise pot[len(pylayers,Ntimes,Npts)]
+        All points x,y must be in the same aquifer aq
+        t may be unordered and contain duplicates
+        With workers > 1 the elements are computed by a pool of threads in the same process; this runs in parallel
+        as the Fortran routines release the GIL. The contributions are added in the same order as without workers'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.aq.findAquiferData(x[0],y[0])
         if pylayers is None: pylayers = range(aq.Naq)
         Nlayers = len(pylayers)
+        Npts = len(x)
         time = np.atleast_1d(t).copy()
-        pot = np.zeros((self.Ngvbc, aq.Naq, self.Np),'D')
-        for i in range(self.Ngbc):
-            pot[i,:] += self.gbcList[i].unitpotential(x,y,aq)
-        for e in self.vzbcList:
-            pot += e.potential(x,y,aq)
-        if pylayers is None:
-            pot = np.sum( pot[:,np.newaxis,:,:] * aq.eigvec, 2 )
-        else:
-            pot = np.sum( pot[:,np.newaxis,:,:] * aq.eigvec[pylayers,:], 2 )
-        if derivative > 0: pot *= self.p**derivative
+        pot = np.zeros((self.Ngvbc, aq.Naq, self.Np, Npts),'D')
+        if self.elementindex is None: self.setelementindex()
+        boxgbc,boxvzbc = self.elementindex
+        # (function,column,ind); column is None for elements with parameters for all columns
+        terms = [ (self.gbcGroupList[i].unitpotentialv,i,ind) for i,ind in self.reaching(boxgbc,x,y) ] + \
+                [ (self.vzbcList[i].potentialv,None,ind) for i,ind in self.reaching(boxvzbc,x,y) ]
+        def contribution(term):
+            return term[0](x[term[2]],y[term[2]],aq)
+        pool = ThreadPool(workers) if workers > 1 else None
+        try:
+            parts = pool.imap(contribution,terms) if pool else ( contribution(term) for term in terms )
+            for k,part in enumerate(parts):  # Each part is added as soon as it is computed
+                func,i,ind = terms[k]
+                if i is None:
+                    pot[...,ind] += part
+                else:
+                    pot[i][...,ind] += part
+        finally:
+            if pool: pool.terminate()
+        pot = np.sum( pot[:,np.newaxis,:,:,:] * aq.eigvec[pylayers,:,:,np.newaxis], 2 )
+        if derivative > 0: pot *= self.p[:,np.newaxis]**derivative
         if returnphi: return pot
-        rv = np.zeros((Nlayers,len(time)))
-        if (time[0] < self.tmin) or (time[-1] > self.tmax): print 'Warning, some of the times are smaller than tmin or larger than tmax; zeros are substituted'
-        #
-        for k in range(self.Ngvbc):
-            e = self.gvbcList[k]
-            for itime in range(e.Ntstart):
-                t = time - e.tstart[itime]
-                it = 0
-                if t[-1] >= self.tmin:  # Otherwise all zero
-                    if (t[0] < self.tmin): it = np.argmax( t >= self.tmin )  # clever call that should be replaced with find_first function when included in numpy
-                    for n in range(self.Nin):
-                        tp = t[ (t >= self.tintervals[n]) & (t < self.tintervals[n+1]) ]
-                        ## I think these lines are not needed anymore as I modified tintervals[0] and tintervals[-1] by eps
-                        #if n == self.Nin-1:
-                        #    tp = t[ (t >= self.tintervals[n]) & (t <= self.tintervals[n+1]) ]
-                        #else:
-                        #    tp = t[ (t >= self.tintervals[n]) & (t < self.tintervals[n+1]) ]
-                        Nt = len(tp)
-                        if Nt > 0:  # if all values zero, don't do the inverse transform
-                            for i in range(Nlayers):
-                                # I used to check the first value only, but it seems that checking that nothing is zero is needed and should be sufficient
-                                #if np.abs( pot[k,i,n*self.Npin] ) > 1e-20:  # First value very small
-                                if not np.any( pot[k,i,n*self.Npin:(n+1)*self.Npin] == 0.0) : # If there is a zero item, zero should be returned; funky enough this can be done with a straight equal comparison
-                                    rv[i,it:it+Nt] += e.bc[itime] * invlaptrans.invlap( tp, self.tintervals[n], self.tintervals[n+1], pot[k,i,n*self.Npin:(n+1)*self.Npin], self.gamma[n], self.M, Nt )
-                            it = it + Nt
-        return rv
+        if (time.min() < self.tmin) or (time.max() > self.tmax): print 'Warning, some of the times are smaller than tmin or larger than tmax; zeros are substituted'
+        rv = self.inverseLapTranGvbc( pot.swapaxes(2,3).reshape(self.Ngvbc,Nlayers*Npts,self.Np), time )
+        return rv.reshape(Nlayers,Npts,len(time)).swapaxes(1,2)
     def discharge(self,x,y,t,layers=None,aq=None,derivative=0):
         '''Returns qx[Naq,Ntimes],qy[Naq,Ntimes] if layers=None, otherwise qx[len(layers,Ntimes)],qy[len(pylayers,Ntimes)]
-        t must be ordered '''
+        t may be unordered and contain duplicates '''
         if aq is None: aq = self.aq.findAquiferData(x,y)
         if layers is None:
             pylayers = range(aq.Naq)
@@ -140,11 +310,14 @@ class TimModel:
         Nlayers = len(pylayers)
         time = np.atleast_1d(t).copy()
         disx,disy = np.zeros((self.Ngvbc, aq.Naq, self.Np),'D'), np.zeros((self.Ngvbc, aq.Naq, self.Np),'D')
-        for i in range(self.Ngbc):
-            qx,qy = self.gbcList[i].unitdischarge(x,y,aq)
+        if self.elementindex is None: self.setelementindex()
+        boxgbc,boxvzbc = self.elementindex
+        xp,yp = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        for i,ind in self.reaching(boxgbc,xp,yp):
+            qx,qy = self.gbcGroupList[i].unitdischarge(x,y,aq)
             disx[i,:] += qx; disy[i,:] += qy
-        for e in self.vzbcList:
-            qx,qy = e.discharge(x,y,aq)
+        for i,ind in self.reaching(boxvzbc,xp,yp):
+            qx,qy = self.vzbcList[i].discharge(x,y,aq)
             disx += qx; disy += qy
         if pylayers is None:
             disx = np.sum( disx[:,np.newaxis,:,:] * aq.eigvec, 2 )
@@ -155,134 +328,602 @@ class TimModel:
         if derivative > 0:
             disx *= self.p**derivative
             disy *= self.p**derivative
-        rvx,rvy = np.zeros((Nlayers,len(time))), np.zeros((Nlayers,len(time)))
-        if (time[0] < self.tmin) or (time[-1] > self.tmax): print 'Warning, some of the times are smaller than tmin or larger than tmax; zeros are substituted'
-        #
-        for k in range(self.Ngvbc):
-            e = self.gvbcList[k]
-            for itime in range(e.Ntstart):
-                t = time - e.tstart[itime]
-                it = 0
-                if t[-1] >= self.tmin:  # Otherwise all zero
-                    if (t[0] < self.tmin): it = np.argmax( t >= self.tmin )  # clever call that should be replaced with find_first function when included in numpy
-                    for n in range(self.Nin):
-                        tp = t[ (t >= self.tintervals[n]) & (t < self.tintervals[n+1]) ]
-                        Nt = len(tp)
-                        if Nt > 0:  # if all values zero, don't do the inverse transform
-                            for i in range(Nlayers):
-                                if not np.any( disx[k,i,n*self.Npin:(n+1)*self.Npin] == 0.0) : # If there is a zero item, zero should be returned; funky enough this can be done with a straight equal comparison
-                                    rvx[i,it:it+Nt] += e.bc[itime] * invlaptrans.invlap( tp, self.tintervals[n], self.tintervals[n+1], disx[k,i,n*self.Npin:(n+1)*self.Npin], self.gamma[n], self.M, Nt )
-                                    rvy[i,it:it+Nt] += e.bc[itime] * invlaptrans.invlap( tp, self.tintervals[n], self.tintervals[n+1], disy[k,i,n*self.Npin:(n+1)*self.Npin], self.gamma[n], self.M, Nt )
-                            it = it + Nt
+        if (time.min() < self.tmin) or (time.max() > self.tmax): print 'Warning, some of the times are smaller than tmin or larger than tmax; zeros are substituted'
+        rv = self.inverseLapTranGvbc( np.concatenate((disx,disy),1), time )
+        rvx,rvy = rv[:Nlayers], rv[Nlayers:]
         return rvx,rvy
-    def head(self,x,y,t,layers=None,aq=None,derivative=0):
+    def head(self,x,y,t,layers=None,aq=None,derivative=0,workers=1):
         if aq is None: aq = self.aq.findAquiferData(x,y)
         if layers is None:
             pylayers = range(aq.Naq)
         else:
             pylayers = np.atleast_1d(layers) - 1
-        pot = self.potential(x,y,t,pylayers,aq,derivative)
+        pot = self.potential(x,y,t,pylayers,aq,derivative,workers=workers)
         return aq.potentialToHead(pot,pylayers)
+    def headv(self,x,y,t,layers=None,aq=None,derivative=0,workers=1):
+        '''Returns h[Nlayers,Ntimes,Npts]; all points x,y must be in the same aquifer aq; workers as in potentialv'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.aq.findAquiferData(x[0],y[0])
+        if layers is None:
+            pylayers = range(aq.Naq)
+        else:
+            pylayers = np.atleast_1d(layers) - 1
+        pot = self.potentialv(x,y,t,pylayers,aq,derivative,workers=workers)
+        return pot / aq.Tcol[pylayers,:,np.newaxis]
     def headinside(self,elabel,t):
         return self.elementDict[elabel].headinside(t)
     def strength(self,elabel,t):
         return self.elementDict[elabel].strength(t)
-    def headalongline(self,x,y,t,layers=None):
+    def headalongline(self,x,y,t,layers=None,workers=1):
         '''Returns head[Nlayers,len(t),len(x)]
-        Assumes same number of layers for each x and y
-        layers may be None or list of layers for which head is computed'''
+        layers may be None or list of layers for which head is computed; workers as in potentialv
+        If layers is None, Nlayers is the largest number of layers of the aquifers of the model,
+        and the head is nan in layers that do not exist in the aquifer of a point
+        Points are grouped by aquifer and each group is computed at once'''
         xg,yg = np.atleast_1d(x),np.atleast_1d(y)
-        if layers is None:
-            Nlayers = self.aq.findAquiferData(xg[0],yg[0]).Naq
-        else:
-            Nlayers = len(np.atleast_1d(layers))
+        Nlayers = self.nlayers(layers)
         nx = len(xg)
         if len(yg) == 1:
             yg = yg * np.ones(nx)
         t = np.atleast_1d(t)
-        h = np.zeros( (Nlayers,len(t),nx) )
-        for i in range(nx):
-            h[:,:,i] = self.head(xg[i],yg[i],t,layers)
+        h = np.empty( (Nlayers,len(t),nx) )
+        h.fill(np.nan)
+        for aq,ind in self.aquifergroups(xg,yg):
+            hg = self.headv(xg[ind],yg[ind],t,layers,aq,workers=workers)
+            h[:len(hg),:,ind] = hg
         return h
-    def headgrid(self,x1,x2,nx,y1,y2,ny,t,layers=None,printrow=False):
-        '''Returns h[Nlayers,Ntimes,Ny,Nx]. If layers is None, all layers are returned'''
-        xg,yg = np.linspace(x1,x2,nx), np.linspace(y1,y2,ny)
+    def headalongpolyline(self,xy,ds,t,layers=None):
+        '''Returns s,x,y,head[Nlayers,len(t),len(s)] along the polyline through the points xy, see headalongline
+        The points are spaced at most ds apart and include the vertices; s is the distance along the polyline
+        All points are computed in one pass per aquifer along the line'''
+        xy = np.atleast_2d(xy).astype('d')
+        x,y,s = [xy[:1,0]], [xy[:1,1]], [np.zeros(1)]
+        for (xa,ya),(xb,yb) in zip(xy[:-1],xy[1:]):
+            L = np.hypot(xb-xa,yb-ya)
+            n = max( int(np.ceil(L/ds - 1e-8)), 1 )  # Number of parts; 1e-8 so that rounding does not add a part
+            f = np.arange(1,n+1) / float(n)
+            x.append(xa + f*(xb-xa)); y.append(ya + f*(yb-ya)); s.append(s[-1][-1] + f*L)
+        x,y,s = np.hstack(x), np.hstack(y), np.hstack(s)
+        return s,x,y,self.headalongline(x,y,t,layers)
+    def nlayers(self,layers=None):
+        '''Returns the number of layers returned by headalongline and headgrid'''
         if layers is None:
-            Nlayers = self.aq.findAquiferData(xg[0],yg[0]).Naq
-        else:
-            Nlayers = len(np.atleast_1d(layers))
-        t = np.atleast_1d(t)
-        h = np.empty( (Nlayers,len(t),ny,nx) )
-        for j in range(ny):
-            if printrow: print str(j)+' '
-            for i in range(nx):
-                h[:,:,j,i] = self.head(xg[i],yg[j],t,layers)
-        return h
-    def headgrid2(self,xg,yg,t,layers=None,printrow=False):
-        '''Returns h[Nlayers,Ntimes,Ny,Nx]. If layers is None, all layers are returned'''
+            return max([ aq.Naq for aq in [self.aq] + self.aq.inhomList ])
+        return len(np.atleast_1d(layers))
+    def aquifergroups(self,x,y):
+        '''Returns list of (aq,ind) with the points x,y grouped by aquifer; ind is a boolean array'''
+        aqlist = [self.aq] + self.aq.inhomList
+        iaq = self.aq.findAquiferDatav(x,y)
+        return [ (aqlist[i],iaq == i) for i in np.unique(iaq) ]
+    def headgrid(self,x1,x2,nx,y1,y2,ny,t,layers=None,printrow=False,workers=1,backend='process',tile=32):
+        '''Returns h[Nlayers,Ntimes,Ny,Nx]. If layers is None, all layers are returned. See headgrid2'''
+        xg,yg = np.linspace(x1,x2,nx), np.linspace(y1,y2,ny)
+        return self.headgrid2(xg,yg,t,layers,printrow,workers,backend,tile)
+    def headgrid2(self,xg,yg,t,layers=None,printrow=False,workers=1,backend='process',tile=32):
+        '''Returns h[Nlayers,Ntimes,Ny,Nx]. If layers is None, all layers are returned
+        The grid is computed in tiles of tile by tile points; printrow prints the progress per tile.
+        With workers > 1 the tiles are computed by a pool of workers; backend as in assemble.
+        Forked workers inherit the solved model and write into h in shared memory'''
         nx,ny = len(xg), len(yg)
-        if layers is None:
-            Nlayers = self.aq.findAquiferData(xg[0],yg[0]).Naq
-        else:
-            Nlayers = len(np.atleast_1d(layers))
+        Nlayers = self.nlayers(layers)
         t = np.atleast_1d(t)
-        h = np.empty( (Nlayers,len(t),ny,nx) )
-        for j in range(ny):
-            if printrow: print str(j)+' '
-            for i in range(nx):
-                h[:,:,j,i] = self.head(xg[i],yg[j],t,layers)
+        tiles = [ (j,min(j+tile,ny),i,min(i+tile,nx)) for j in range(0,ny,tile) for i in range(0,nx,tile) ]
+        if self.elementindex is None: self.setelementindex()  # Before forking, so that workers do not each build it
+        fork = (workers > 1) and (backend == 'process') and hasattr(os,'fork')
+        if fork:  # anonymous mmap is shared with the forked workers
+            h = np.frombuffer( mmap.mmap(-1,Nlayers*len(t)*ny*nx*8), 'd' ).reshape(Nlayers,len(t),ny,nx)
+        else:
+            h = np.empty( (Nlayers,len(t),ny,nx) )
+        if workers <= 1:
+            for k,tl in enumerate(tiles):
+                self.headtile(h,xg,yg,t,layers,tl)
+                if printrow: print 'tile %d of %d' % (k+1,len(tiles))
+            return h
+        if fork:
+            forkgrid.update( model=self, h=h, xg=xg, yg=yg, t=t, layers=layers )
+            pool = multiprocessing.Pool(workers)
+            func = forkheadtile
+        else:
+            pool = ThreadPool(workers)
+            func = lambda tl: self.headtile(h,xg,yg,t,layers,tl)
+        try:
+            for k,dummy in enumerate( pool.imap_unordered(func,tiles) ):
+                if printrow: print 'tile %d of %d' % (k+1,len(tiles))
+        finally:
+            pool.terminate()
+            forkgrid.clear()
         return h
-    def inverseLapTran(self,pot,t):
+    def headtile(self,h,xg,yg,t,layers,tile):
+        '''Fills h[:,:,j0:j1,i0:i1] for tile (j0,j1,i0,i1) of the grid xg,yg; all points of the tile are computed at once'''
+        j0,j1,i0,i1 = tile
+        x,y = np.meshgrid(xg[i0:i1],yg[j0:j1])
+        h[:,:,j0:j1,i0:i1] = self.headalongline(x.ravel(),y.ravel(),t,layers).reshape(len(h),len(t),j1-j0,i1-i0)
+    def invlapweights(self,n,t):
+        '''Returns complex weights W[len(t),Npin] for interval n so that f(t) = imag( W @ fp )
+        Only for invmethod 'linear'; the last W of each interval is cached'''
+        key = t.tostring()
+        if n in self.invlapweightscache and self.invlapweightscache[n][0] == key:
+            return self.invlapweightscache[n][1]
+        h = np.pi / self.Npin
+        p = self.p[n*self.Npin:(n+1)*self.Npin]
+        dpdtheta = self.dpdtheta[n*self.Npin:(n+1)*self.Npin]
+        W = h / np.pi * np.exp( np.outer(t,p) ) * dpdtheta
+        W[:,0] *= 0.5  # trapezoidal rule, theta=0 is on the real axis
+        self.invlapweightscache[n] = (key,W)
+        return W
+    def invlapprepare(self,pot):
+        '''Returns coefficients d with the shape of pot[...,Np] that are needed to invert pot at any time
+        For de Hoog these are the continued fraction coefficients, for the linear method the series itself
+        Series with a zero item get all zero coefficients so that they return zero'''
+        fp = pot.reshape(-1,self.Np)
+        if self.invmethod == 'linear':
+            d = np.zeros_like(fp)
+            for n in range(self.Nin):
+                sl = slice(n*self.Npin,(n+1)*self.Npin)
+                d[:,sl] = fp[:,sl] * ~np.any(fp[:,sl] == 0.0, 1)[:,np.newaxis]
+        else:
+            d = np.empty_like(fp)
+            for n in range(self.Nin):
+                sl = slice(n*self.Npin,(n+1)*self.Npin)
+                d[:,sl] = invlaptrans.invlapcoefv( fp[:,sl] )
+        return d.reshape(pot.shape)
+    def timeintervals(self,t):
+        '''Returns the number of the interval of each time in array t; -1 if t < tmin or t is beyond the last interval'''
+        interval = np.searchsorted(self.tintervals, t, side='right') - 1
+        interval[ (t < self.tmin) | (interval >= self.Nin) ] = -1
+        return interval
+    def inverseLapTranGvbc(self,pot,time,d=None):
+        '''Returns rv[Nrows,Ntimes]; pot[Ngvbc,Nrows,Np] is the transform for every given and variable bc element
+        The inverses are multiplied with the bc of each tstart and superimposed; time may be unordered and contain duplicates
+        d are the coefficients returned by invlapprepare(pot); they are computed when not provided
+        The shifted times of all tstart values of an element that fall in the same interval are evaluated at once,
+        and all elements of one interval are evaluated with one call to invlapevalv'''
+        if d is None: d = self.invlapprepare(pot)
+        time = np.atleast_1d(time)
+        Nrows = d.shape[1]
+        rv = np.zeros((Nrows,len(time)))
+        if self.Ngvbc == 0: return rv
+        # Element number, tstart and bc of every shift
+        kshift = np.hstack([ k * np.ones(e.Ntstart,'i') for k,e in enumerate(self.gvbcList) ])
+        tstart = np.hstack([ e.tstart for e in self.gvbcList ])
+        bc = np.hstack([ e.bc for e in self.gvbcList ])
+        # Bucketing of all shifted times at once
+        tshift = time[np.newaxis,:] - tstart[:,np.newaxis]
+        interval = self.timeintervals(tshift)
+        ishift,itime = np.nonzero( interval >= 0 )
+        interval,tshift = interval[ishift,itime], tshift[ishift,itime]
+        rvT = rv.T  # view used to scatter with np.add.at, as the same time may be hit by several shifts
+        for n in np.unique(interval):
+            sel = interval == n
+            ishiftn, itimen, tn = ishift[sel], itime[sel], tshift[sel]
+            sl = slice(n*self.Npin,(n+1)*self.Npin)
+            if self.invmethod == 'linear':
+                # Inverse is linear in fp: series of shifts with the same tstart are superimposed first
+                for ts in np.unique(tstart[ishiftn]):
+                    shifts = np.unique( ishiftn[ tstart[ishiftn] == ts ] )
+                    fp = np.sum( bc[shifts,np.newaxis,np.newaxis] * d[kshift[shifts],:,sl], 0 )
+                    ind = itimen[ ishiftn == shifts[0] ]
+                    rv[:,ind] += np.imag( np.dot( fp, self.invlapweights(n,time[ind]-ts).T ) )
+                continue
+            klist = np.unique(kshift[ishiftn])
+            Nt = [ np.sum(kshift[ishiftn] == k) for k in klist ]
+            tp = np.zeros((len(klist),Nrows,max(Nt)))
+            for i,k in enumerate(klist):
+                tp[i,:,:Nt[i]] = tn[ kshift[ishiftn] == k ]
+            nt = np.repeat(Nt,Nrows).astype('i')
+            ft = invlaptrans.invlapevalv( tp.reshape(-1,max(Nt)), self.tintervals[n], self.tintervals[n+1], d[klist,:,sl].reshape(-1,self.Npin), self.gamma[n], nt )
+            ft.shape = (len(klist),Nrows,max(Nt))
+            for i,k in enumerate(klist):
+                ink = kshift[ishiftn] == k
+                np.add.at( rvT, itimen[ink], bc[ishiftn[ink],np.newaxis] * ft[i,:,:Nt[i]].T )
+        return rv
+    def inverseLapTran(self,pot,t,d=None):
         '''returns array of potentials of len(t)
-        t must be ordered and tmin <= t <= tmax'''
+        t may be unordered and contain duplicates; zero is returned for t < tmin
+        d are the coefficients returned by invlapprepare(pot); they are computed when not provided'''
+        if d is None: d = self.invlapprepare(pot)
         t = np.atleast_1d(t)
         rv = np.zeros(len(t))
-        it = 0
-        if t[-1] >= self.tmin:  # Otherwise all zero
-            if (t[0] < self.tmin): it = np.argmax( t >= self.tmin )  # clever call that should be replaced with find_first function when included in numpy
-            for n in range(self.Nin):
-                if n == self.Nin-1:
-                    tp = t[ (t >= self.tintervals[n]) & (t <= self.tintervals[n+1]) ]
-                else:
-                    tp = t[ (t >= self.tintervals[n]) & (t < self.tintervals[n+1]) ]
-                Nt = len(tp)
-                if Nt > 0:  # if all values zero, don't do the inverse transform
-                    # Not needed anymore: if np.abs( pot[n*self.Npin] ) > 1e-20:
-                    if not np.any( pot[n*self.Npin:(n+1)*self.Npin] == 0.0) : # If there is a zero item, zero should be returned; funky enough this can be done with a straight equal comparison
-                        rv[it:it+Nt] = invlaptrans.invlap( tp, self.tintervals[n], self.tintervals[n+1], pot[n*self.Npin:(n+1)*self.Npin], self.gamma[n], self.M, Nt )
-                    it = it + Nt
+        interval = self.timeintervals(t)
+        for n in np.unique(interval[interval >= 0]):
+            ind = np.nonzero(interval == n)[0]
+            # A series with a zero item has zero coefficients and returns zero
+            if self.invmethod == 'linear':
+                rv[ind] = np.imag( np.dot( self.invlapweights(n,t[ind]), d[n*self.Npin:(n+1)*self.Npin] ) )
+            else:
+                rv[ind] = invlaptrans.invlapeval( t[ind], self.tintervals[n], self.tintervals[n+1], d[n*self.Npin:(n+1)*self.Npin], self.gamma[n], self.M, len(ind) )
         return rv
-    def solve(self,printmat = 0,sendback=0):
-        '''Compute solution'''
-        # Initialize elements
+    def assemble(self,workers=1,backend='process'):
+        '''Returns mat[Np,Neq,Neq] and rhs[Np,Neq,Ngvbc]; p-major storage, so that all systems are solved with one stacked call
+        With workers > 1 the row blocks of the elements are computed by a pool of workers.
+        backend 'process' uses forked processes that write into shared memory (falls back to threads without fork);
+        backend 'thread' uses threads, which only run in parallel where the Fortran routines release the GIL'''
+        blocks = []
+        ieq = 0
+        for e in self.elementList:
+            if e.Nunknowns > 0:
+                blocks.append( (e,ieq) )
+                ieq += e.Nunknowns
+        fork = (workers > 1) and (backend == 'process') and hasattr(os,'fork')
+        if fork:  # anonymous mmap is shared with the forked workers
+            mat = np.frombuffer( mmap.mmap(-1,self.Np*self.Neq*self.Neq*16), 'D' ).reshape(self.Np,self.Neq,self.Neq)
+            rhs = np.frombuffer( mmap.mmap(-1,self.Np*self.Neq*self.Ngvbc*16), 'D' ).reshape(self.Np,self.Neq,self.Ngvbc)
+        else:
+            mat = np.empty( (self.Np,self.Neq,self.Neq), 'D' )
+            rhs = np.empty( (self.Np,self.Neq,self.Ngvbc), 'D' )
+        order = sorted( range(len(blocks)), key = lambda i: -blocks[i][0].Nunknowns )  # largest blocks first
+        if workers <= 1:
+            for i in order:
+                assemblerows(mat,rhs,*blocks[i])
+        elif fork:
+            forkassembly.update( mat=mat, rhs=rhs, blocks=blocks )
+            pool = multiprocessing.Pool(workers)
+            try:
+                pool.map(forkassemblerows,order,chunksize=1)
+            finally:
+                pool.terminate()
+                forkassembly.clear()
+        else:
+            pool = ThreadPool(workers)
+            try:
+                pool.map(lambda i: assemblerows(mat,rhs,*blocks[i]),order,chunksize=1)
+            finally:
+                pool.terminate()
+        return mat,rhs
+    def equationblocks(self,columns=None):
+        '''Returns a list of (element,ieq) for the elements with unknowns, where ieq is the first column of the
+        element in the matrix, and the number of columns. When columns is a list of elements, only these elements
+        are included and the columns are counted for these elements only; equation(columns) uses this.
+        The columns are sorted with the position of the elements in elementList, which is stored in elementorder,
+        so that the cost depends on the number of columns only'''
+        if columns is None:
+            elements = self.elementList
+        else:
+            if (self.elementorder is None) or (self.elementorder[0] is not self.elementList):
+                self.elementorder = ( self.elementList, dict( (e,i) for i,e in enumerate(self.elementList) ) )
+            elements = sorted( set(columns), key = self.elementorder[1].get )
+        blocks = []
+        ieq = 0
+        for e in elements:
+            if e.Nunknowns > 0:
+                blocks.append( (e,ieq) )
+                ieq += e.Nunknowns
+        return blocks, ieq
+    def columnkey(self,g):
+        '''Key of a column of the right-hand side: the element, or the elements and scales of a group of given elements'''
+        if isinstance(g,GivenElementGroup): return tuple(g.elements), tuple(g.scales)
+        if g.type == 'g': return (g,), (1.0,)
+        return g
+    def assembleincremental(self,workers=1,backend='process'):
+        '''Returns mat and rhs like assemble, reusing the mat and rhs of the previous solve with incremental=1.
+        Only the rows of the elements in dirty and their columns in the other rows are built again.
+        Columns of the right-hand side are built again when one of the given elements in the column changed.
+        Everything is built with assemble when the elements with unknowns are not the same as before'''
+        layout = self.equationblocks()
+        keys = [ self.columnkey(g) for g in self.gvbcList ]
+        if (self.assembled is None) or (self.assembled[2] != layout):
+            mat,rhs = self.assemble(workers,backend)
+            self.assembled = (mat,rhs,layout,keys)
+            return mat,rhs
+        mat,rhsold,blocks,oldkeys = self.assembled[0], self.assembled[1], layout[0], self.assembled[3]
+        dirty = set(self.dirty)
+        # Columns of the right-hand side that did not change are moved to their new place
+        rhs = np.empty( (self.Np,self.Neq,self.Ngvbc), 'D' )
+        newcols = []
+        for k,key in enumerate(keys):
+            if (key in oldkeys) and not ( (k < self.Ngbc) and np.any([ e in dirty for e in key[0] ]) ):
+                rhs[:,:,k] = rhsold[:,:,oldkeys.index(key)]
+            else:
+                newcols.append(k)
+        # Ditch storage puts the head of the given elements in the column of the ditch, so its rows are built again
+        givenchanged = (len(newcols) > 0) or (keys[:self.Ngbc] != oldkeys[:len(oldkeys)-self.Nvbc])
+        rows = [ e for e,ieq in blocks if (e in dirty) or (givenchanged and getattr(e,'Astorage',None) is not None) ]
+        for e,ieq in blocks:
+            if e in rows: assemblerows(mat,rhs,e,ieq)
+        columns = [ e for e,ieq in blocks if e in dirty ]
+        colblocks = self.equationblocks(columns)[0]
+        jeqs = [ ieq for e,ieq in blocks if e in dirty ]
+        for e,ieq in blocks:
+            if e in rows: continue
+            if len(columns) > 0:
+                emat = e.equation(columns)[0]
+                for (c,jcol),jeq in zip(colblocks,jeqs):
+                    mat[ :, ieq:ieq+e.Nunknowns, jeq:jeq+c.Nunknowns ] = emat[:,jcol:jcol+c.Nunknowns,:].transpose(2,0,1)
+            if len(newcols) > 0:
+                rhs[ :, ieq:ieq+e.Nunknowns, newcols ] = e.rhsgiven([ self.gvbcList[k] for k in newcols ]).transpose(2,0,1)
+        self.assembled = (mat,rhs,layout,keys)
+        return mat,rhs
+    def solveschur(self,mat,rhs):
+        '''Returns sol[Np,Neq,Ngvbc]. The unknowns of the inhomogeneities (elements with an InhomEquation) are
+        eliminated with a Schur complement, so that only the inhomogeneity block is factorized and a system with the
+        other unknowns is solved. The factors are kept in inhomfactors and reused as long as the inhomogeneity block
+        does not change, for example when solving with incremental=1 after changing wells or line-sinks'''
+        inhom = np.zeros(self.Neq,'bool')
+        for e,ieq in self.equationblocks()[0]:
+            if isinstance(e,InhomEquation): inhom[ieq:ieq+e.Nunknowns] = True
+        iI, iE = np.nonzero(inhom)[0], np.nonzero(~inhom)[0]
+        if (len(iI) == 0) or (len(iE) == 0): return np.linalg.solve( mat, rhs )
+        AII = mat[:,iI[:,np.newaxis],iI]
+        if (self.inhomfactors is None) or (self.inhomfactors[0].shape != AII.shape) or (not np.array_equal(self.inhomfactors[0],AII)):
+            self.inhomfactors = ( AII, [ scipy.linalg.lu_factor(AII[i]) for i in range(self.Np) ] )
+        sol = np.empty_like(rhs)
+        NE = len(iE)
+        for i,lu in enumerate(self.inhomfactors[1]):
+            AEI = mat[i][iE[:,np.newaxis],iI]
+            # Inhomogeneity unknowns in terms of the other unknowns: xI = Y[:,NE:] - Y[:,:NE] xE
+            Y = scipy.linalg.lu_solve( lu, np.hstack(( mat[i][iI[:,np.newaxis],iE], rhs[i,iI] )) )
+            S = mat[i][iE[:,np.newaxis],iE] - np.dot(AEI,Y[:,:NE])
+            sol[i,iE] = np.linalg.solve( S, rhs[i,iE] - np.dot(AEI,Y[:,NE:]) )
+            sol[i,iI] = Y[:,NE:] - np.dot(Y[:,:NE],sol[i,iE])
+        return sol
+    def solvehmatrix(self,tol=1e-10,leafsize=32,eta=1.0):
+        '''Returns sol[Np,Neq,Ngvbc] solved with a hierarchical matrix stored in hmatrix, see HMatrix.
+        The far blocks are approximated and the iterations are stopped with relative tolerance tol'''
+        self.hmatrix = HMatrix(self,leafsize,eta,tol)
+        sol = self.hmatrix.solve(tol)
+        ranks = [ U[ip].shape[1] for rows,cols,U,V in self.hmatrix.far for ip in range(self.Np) if V[ip] is not None ]
+        print 'hmatrix: %d near and %d far blocks, max rank %d, %.1f%% of the matrix stored, max iterations %d, direct solves %d' % \
+            ( len(self.hmatrix.nearblocks), len(self.hmatrix.far), max(ranks+[0]), 100 * self.hmatrix.storage(), self.hmatrix.iterations.max(),
+              np.sum(self.hmatrix.iterations[:,0] < 0) )
+        return sol
+    def setinterval(self,n,p,gamma,tintervals,dpdtheta):
+        '''Makes the model a model with one time interval: interval n of the full arrays p, gamma, tintervals and dpdtheta.
+        The model has all intervals again after setinterval(None,...)'''
+        if n is None:
+            self.p, self.Np, self.Nin = p, len(p), len(gamma)
+            self.gamma, self.tintervals, self.dpdtheta = gamma, tintervals, dpdtheta
+            return
+        sl = slice(n*self.Npin,(n+1)*self.Npin)
+        self.p, self.Np, self.Nin = p[sl], self.Npin, 1
+        self.gamma, self.tintervals = gamma[n:n+1], tintervals[n:n+2]
+        if len(dpdtheta) > 0: self.dpdtheta = dpdtheta[sl]
+    def solvelowmemory(self,workers=1,backend='process',solver='dense',tol=1e-10):
+        '''Returns sol[Np,Neq,Ngvbc]. The aquifers and elements are initialized for the p values of one time interval,
+        and the matrix of that interval is built and solved before the next interval, so that Npin instead of Np
+        matrices are stored; with solver='sparse' only their nonzero part. The model is initialized for all p values at the end'''
+        sol = np.empty( (self.Np,self.Neq,self.Ngvbc), 'D' )
+        full = (self.p, self.gamma, self.tintervals, self.dpdtheta)
+        Nin = self.Nin
+        try:
+            for n in range(Nin):
+                self.setinterval(n,*full)
+                self.initialize()
+                sol[n*self.Npin:(n+1)*self.Npin] = self.solvematrix(solver,tol,workers,backend)  # Matrix is freed on return
+        finally:
+            self.setinterval(None,*full)
         self.initialize()
+        return sol
+    def solvematrix(self,solver='dense',tol=1e-10,workers=1,backend='process'):
+        '''Returns sol[Np,Neq,Ngvbc] for the p values the model is initialized for; the matrix is built and solved
+        with solver 'dense', 'sparse', 'gmres', 'bicgstab' or 'schur'. Used for the time intervals of solvelowmemory and solveintervals'''
+        assert solver in ['dense','sparse','gmres','bicgstab','schur'], "TTim error: solver " + str(solver) + " cannot be used for one time interval at a time"
+        if solver == 'sparse':
+            mat,rhs = self.assemblesparse()
+            return self.solvesparse(mat,rhs)
+        mat,rhs = self.assemble(workers,backend)
+        if solver in ['gmres','bicgstab']:
+            return self.solveiterative(mat,rhs,solver,tol)
+        elif solver == 'schur':
+            return self.solveschur(mat,rhs)
+        return np.linalg.solve( mat, rhs )
+    def solveintervals(self,workers,solver='dense',tol=1e-10):
+        '''Returns sol[Np,Neq,Ngvbc]. The p values of each time interval are handled by a forked worker
+        that initializes the aquifers and elements for its own p values only, builds the matrix and solves it with solver, see solvematrix'''
+        sol = np.frombuffer( mmap.mmap(-1,self.Np*self.Neq*self.Ngvbc*16), 'D' ).reshape(self.Np,self.Neq,self.Ngvbc)
+        forksolve.update( model=self, sol=sol, solver=solver, tol=tol, p=self.p, gamma=self.gamma, tintervals=self.tintervals, dpdtheta=self.dpdtheta )
+        pool = multiprocessing.Pool( min(workers,self.Nin) )
+        try:
+            pool.map(forksolveinterval,range(self.Nin),chunksize=1)
+        finally:
+            pool.terminate()
+            forksolve.clear()
+        return sol
+    def assemblesparse(self):
+        '''Returns mat, a list of Np sparse matrices in csr format, and rhs[Np,Neq,Ngvbc]
+        Only the nonzero entries are stored; the influence of an element is exactly zero beyond Rzero,
+        which makes most of the matrix zero for large p in large models.
+        The rows of an element are only built for the columns of the elements that reach one of its control points
+        (see setelementindex), but for all p, so an element that reaches all others still gives a full row block'''
+        rows, cols, ips, vals = [], [], [], []
+        rhs = np.empty( (self.Np,self.Neq,self.Ngvbc), 'D' )
+        if self.elementindex is None: self.setelementindex()
+        blocks = self.equationblocks()[0]
+        ieqs = dict(blocks)
+        for e,ieq in blocks:
+            columns = [ self.vzbcList[i] for i,ind in self.reaching(self.elementindex[1],e.xc,e.yc) if self.vzbcList[i].Nunknowns > 0 ]
+            colblocks = self.equationblocks(columns)[0]
+            colindex = np.hstack([ np.arange(ieqs[c],ieqs[c]+c.Nunknowns) for c,jcol in colblocks ])
+            emat = e.equation(columns)[0]
+            r,c,k = np.nonzero(emat)
+            rows.append(r+ieq); cols.append(colindex[c]); ips.append(k); vals.append(emat[r,c,k])
+            rhs[ :, ieq:ieq+e.Nunknowns, : ] = e.equationrhs().transpose(2,0,1)
+        rows, cols, ips, vals = np.hstack(rows), np.hstack(cols), np.hstack(ips), np.hstack(vals)
+        isort = np.argsort(ips,kind='mergesort')
+        istart = np.searchsorted(ips[isort],np.arange(self.Np+1))
+        mat = []
+        for i in range(self.Np):
+            ind = isort[istart[i]:istart[i+1]]
+            mat.append( scipy.sparse.csr_matrix( (vals[ind],(rows[ind],cols[ind])), shape=(self.Neq,self.Neq) ) )
+        return mat,rhs
+    def solvesparse(self,mat,rhs,densemax=0.3):
+        '''Returns sol[Np,Neq,Ngvbc] for the sparse matrices of assemblesparse
+        A sparse direct solver is used for each p, unless more than densemax of the matrix is nonzero'''
+        sol = np.empty_like(rhs)
+        for i in range(self.Np):
+            if mat[i].nnz > densemax * self.Neq**2:
+                sol[i] = np.linalg.solve( mat[i].toarray(), rhs[i] )
+            else:
+                sol[i] = scipy.sparse.linalg.spsolve( mat[i].tocsc(), rhs[i] ).reshape(self.Neq,self.Ngvbc)
+        return sol
+    def solveiterative(self,mat,rhs,method='gmres',tol=1e-10,maxiter=30):
+        '''Returns sol[Np,Neq,Ngvbc] computed with method 'gmres' or 'bicgstab'
+        The first p of each interval is solved with an LU factorization. For the next p values the solution
+        of the previous p is the initial guess and the last factorization is the preconditioner.
+        When the iteration does not converge within maxiter, the current matrix is factorized and used.
+        iterations[Np,Ngvbc] stores the number of iterations; -1 means solved with a new factorization'''
+        iterative = {'gmres':scipy.sparse.linalg.gmres,'bicgstab':scipy.sparse.linalg.bicgstab}[method]
+        sol = np.zeros_like(rhs)
+        self.iterations = np.zeros( (self.Np,self.Ngvbc), 'i' )
+        for i in range(self.Np):
+            if i % self.Npin > 0:
+                M = scipy.sparse.linalg.LinearOperator( (self.Neq,self.Neq), matvec=lambda b: scipy.linalg.lu_solve(lu,b), dtype='D' )
+                converged = True
+                for k in range(self.Ngvbc):
+                    if not np.any(rhs[i,:,k]): continue
+                    count = [0]
+                    def callback(xk): count[0] += 1
+                    sol[i,:,k],info = iterative( mat[i], rhs[i,:,k], x0=sol[i-1,:,k], tol=tol, maxiter=maxiter, M=M, callback=callback )
+                    self.iterations[i,k] = count[0]
+                    if info != 0: converged = False
+                if converged: continue
+            lu = scipy.linalg.lu_factor(mat[i])
+            sol[i] = scipy.linalg.lu_solve(lu,rhs[i])
+            self.iterations[i] = -1
+        iterated = self.iterations[self.iterations >= 0]
+        print 'iterations: max %d, mean %.1f, factorizations %d' % ( self.iterations.max(), iterated.mean() if len(iterated) > 0 else 0.0, np.sum(self.iterations[:,0] < 0) )
+        return sol
+    def solve(self,printmat=0,sendback=0,workers=1,backend='process',split='elements',solver='dense',tol=1e-10,keepfactors=0,incremental=0,lowmemory=0):
+        '''Compute solution
+        workers is the number of workers. With split='elements' they build the matrix, see assemble.
+        With split='intervals' each worker solves the p values of one time interval, see solveintervals.
+        solver='sparse' stores only the nonzero part of the matrix and uses a sparse solver, see assemblesparse.
+        solver='gmres' or 'bicgstab' uses warm started iterations with relative tolerance tol, see solveiterative.
+        solver='schur' eliminates the unknowns of the inhomogeneities with a Schur complement, see solveschur.
+        solver='hmatrix' approximates blocks between distant elements with low rank, see solvehmatrix.
+        keepfactors=1 solves with LU factorizations that are stored for add_given_element.
+        incremental=1 only initializes what changed since the previous solve with incremental=1 and rebuilds only
+        the rows and columns of the matrix of the changed elements, see initialize and assembleincremental.
+        lowmemory=1 builds and solves the matrices of one time interval at a time, see solvelowmemory.
+        Combinations that are not supported raise an error instead of ignoring one of the options'''
+        assert solver in ['dense','sparse','gmres','bicgstab','schur','hmatrix'], "TTim error: unknown solver " + str(solver)
+        assert split in ['elements','intervals'], "TTim error: split must be 'elements' or 'intervals'"
+        assert backend in ['process','thread'], "TTim error: backend must be 'process' or 'thread'"
+        assert not (keepfactors and lowmemory), "TTim error: keepfactors=1 stores the factors of all p values and cannot be combined with lowmemory=1"
+        assert not (keepfactors and solver != 'dense'), "TTim error: keepfactors=1 stores dense LU factors and requires solver='dense'"
+        assert not (keepfactors and split == 'intervals'), "TTim error: keepfactors=1 cannot be combined with split='intervals'"
+        assert not (lowmemory and split == 'intervals'), "TTim error: lowmemory=1 cannot be combined with split='intervals'"
+        assert not ( (lowmemory or split == 'intervals') and solver == 'hmatrix' ), "TTim error: solver='hmatrix' cannot be combined with lowmemory=1 or split='intervals'"
+        # Initialize elements
+        self.initialize(incremental)
+        self.lufactors = None
+        assemble = self.assembleincremental if incremental else self.assemble
+        if not incremental: self.assembled = None
         # Compute number of equations
         self.Neq = np.sum( [e.Nunknowns for e in self.elementList] )
         print 'self.Neq ',self.Neq
         if self.Neq == 0:
+            if keepfactors: self.lufactors = []
             print 'No unknowns. Solution complete'
             return
-        mat = np.empty( (self.Neq,self.Neq,self.Np), 'D' )
-        rhs = np.empty( (self.Neq,self.Ngvbc,self.Np), 'D' )
+        if lowmemory and (not printmat):
+            sol = self.solvelowmemory(workers,backend,solver,tol)
+            self.assembled = None
+        elif keepfactors and (not printmat):
+            mat,rhs = assemble(workers,backend)
+            self.lufactors = [ scipy.linalg.lu_factor(mat[i]) for i in range(self.Np) ]
+            sol = np.array([ scipy.linalg.lu_solve(lu,rhs[i]) for i,lu in enumerate(self.lufactors) ])
+        elif (split == 'intervals') and (workers > 1) and (not printmat) and hasattr(os,'fork'):
+            sol = self.solveintervals(workers,solver,tol)
+            self.assembled = None
+        elif (solver == 'sparse') and (not printmat):
+            mat,rhs = self.assemblesparse()
+            sol = self.solvesparse(mat,rhs)
+            self.assembled = None
+        elif (solver in ['gmres','bicgstab']) and (not printmat):
+            mat,rhs = assemble(workers,backend)
+            sol = self.solveiterative(mat,rhs,solver,tol)
+        elif (solver == 'schur') and (not printmat):
+            mat,rhs = assemble(workers,backend)
+            sol = self.solveschur(mat,rhs)
+        elif (solver == 'hmatrix') and (not printmat):
+            sol = self.solvehmatrix(tol)
+            self.assembled = None
+        else:
+            mat,rhs = assemble(workers,backend)
+            if printmat:
+                return mat.transpose(1,2,0),rhs.transpose(1,2,0)
+            sol = np.linalg.solve( mat, rhs )  # sol[Np,Neq,Ngvbc]
         ieq = 0
         for e in self.elementList:
             if e.Nunknowns > 0:
-                mat[ ieq:ieq+e.Nunknowns, :, : ], rhs[ ieq:ieq+e.Nunknowns, :, : ] = e.equation()
+                e.parameters[:,:e.Nunknowns,:] = sol[:,ieq:ieq+e.Nunknowns,:].transpose(2,1,0)
                 ieq += e.Nunknowns
-        if printmat:
-            return mat,rhs
-        for i in range( self.Np ):
-            sol = np.linalg.solve( mat[:,:,i], rhs[:,:,i] )
-            icount = 0
-            for e in self.elementList:
-                for j in range(e.Nunknowns):
-                    e.parameters[:,j,i] = sol[icount,:]
-                    icount += 1
-                e.run_after_solve()
+        for e in self.elementList:
+            e.run_after_solve()
         print 'solution complete'
         if sendback:
-            return sol
+            return sol[-1]
         return
+    def add_given_element(self,e):
+        '''Adds given element e, created after solve with keepfactors=1, without building the matrix again.
+        e gets its own column of the right-hand side; only that column is assembled and it is solved
+        with the stored LU factors of every p'''
+        assert self.lufactors is not None, "TTim error: solve with keepfactors=1 before adding given elements"
+        assert e.type == 'g', "TTim error: only elements with a given bc can be added after solve"
+        assert e not in self.gbcGroupList, "TTim error: element is already part of the solution"
+        if e not in self.gbcList: self.addElement(e)
+        k = self.Ngbc  # New column is the last given column
+        self.gbcGroupList.append(e)
+        self.gvbcList.insert(k,e)
+        self.elementList.insert(len(self.gbcList)-1,e)
+        self.elementorder = None
+        self.Ngbc += 1
+        self.Ngvbc += 1
+        e.setbc()
+        e.initialize()
+        rhs = np.empty( (self.Np,self.Neq), 'D' )
+        ieq = 0
+        for el in self.elementList:
+            if el.Nunknowns > 0:
+                rhs[ :, ieq:ieq+el.Nunknowns ] = el.rhsgiven([e])[:,0,:].T
+                ieq += el.Nunknowns
+        sol = np.array([ scipy.linalg.lu_solve(lu,rhs[i]) for i,lu in enumerate(self.lufactors) ])
+        ieq = 0
+        for el in self.vzbcList:  # Same order as the equations; given elements have no parameters
+            el.parameters = np.insert(el.parameters,k,0.0,axis=0)
+            if el.Nunknowns > 0:
+                el.parameters[k,:el.Nunknowns,:] = sol[:,ieq:ieq+el.Nunknowns].T
+                ieq += el.Nunknowns
+        self.solvestoragecolumns()
+        for el in self.elementList:
+            el.run_after_solve()
+        self.invlapcache = InvLapCache(self)
+        self.elementindex = None
+    def solvestoragecolumns(self):
+        '''Solves the columns of the ditches with storage again with the stored LU factors
+        The head of every given element is part of the right-hand side of these columns, see MscreenDitchEquation,
+        so they change when a given element is added or removed'''
+        for e,ieq in self.equationblocks()[0]:
+            if (e.type != 'v') or (getattr(e,'Astorage',None) is None): continue
+            assert self.lufactors is not None, "TTim error: solve with keepfactors=1 before adding or removing given elements"
+            k = self.Ngbc + self.vbcList.index(e)
+            rhs = np.zeros( (self.Np,self.Neq), 'D' )
+            rhs[ :, ieq:ieq+e.Nunknowns ] = e.equationrhs()[:,k,:].T  # Column k is zero in the rows of the other elements
+            sol = np.array([ scipy.linalg.lu_solve(lu,rhs[i]) for i,lu in enumerate(self.lufactors) ])
+            jeq = 0
+            for el in self.vzbcList:  # Same order as the equations
+                if el.Nunknowns > 0:
+                    el.parameters[k,:el.Nunknowns,:] = sol[:,jeq:jeq+el.Nunknowns].T
+                    jeq += el.Nunknowns
+    def remove_given_element(self,e):
+        '''Removes given element e from a solved model without solving again; e must have its own column'''
+        assert e in self.gbcGroupList, "TTim error: element does not have its own column; set groupgiven=False before solving"
+        k = self.gbcGroupList.index(e)
+        self.gbcGroupList.remove(e)
+        self.gvbcList.remove(e)
+        self.gbcList.remove(e)
+        self.elementList.remove(e)
+        self.elementorder = None
+        if e.label is not None: del self.elementDict[e.label]
+        self.Ngbc -= 1
+        self.Ngvbc -= 1
+        for el in self.vzbcList:
+            el.parameters = np.delete(el.parameters,k,axis=0)
+        self.solvestoragecolumns()
+        for el in self.elementList:
+            el.run_after_solve()
+        self.invlapcache = InvLapCache(self)
+        self.elementindex = None
     def storeinput(self,frame):
         self.inputargs, _, _, self.inputvalues = inspect.getargvalues(frame)
     def write(self):
@@ -342,10 +983,10 @@ def param_maq(kaq=[1],z=[1,0],c=[],Saq=[0.001],Sll=[0],topboundary='imp',phreati
     return kaq,Haq,c,Saq,Sll
         
 class ModelMaq(TimModel):
-    def __init__(self,kaq=[1],z=[1,0],c=[],Saq=[0.001],Sll=[0],topboundary='imp',phreatictop=False,tmin=1,tmax=10,M=20):
+    def __init__(self,kaq=[1],z=[1,0],c=[],Saq=[0.001],Sll=[0],topboundary='imp',phreatictop=False,tmin=1,tmax=10,M=20,invmethod='dehoog'):
         self.storeinput(inspect.currentframe())
         kaq,Haq,c,Saq,Sll = param_maq(kaq,z,c,Saq,Sll,topboundary,phreatictop)
-        TimModel.__init__(self,kaq,Haq,c,Saq,Sll,topboundary,tmin,tmax,M)
+        TimModel.__init__(self,kaq,Haq,c,Saq,Sll,topboundary,tmin,tmax,M,invmethod)
         self.name = 'ModelMaq'
         
 def param_3d(kaq=[1],z=[1,0],Saq=[0.001],kzoverkh=1.0,phreatictop=False):
@@ -367,11 +1008,11 @@ def param_3d(kaq=[1],z=[1,0],Saq=[0.001],kzoverkh=1.0,phreatictop=False):
     return kaq,H,c,Saq,Sll
 
 class Model3D(TimModel):
-    def __init__(self,kaq=[1,1,1],z=[4,3,2,1],Saq=[0.3,0.001,0.001],kzoverkh=[.1,.1,.1],phreatictop=True,tmin=1,tmax=10,M=20):
+    def __init__(self,kaq=[1,1,1],z=[4,3,2,1],Saq=[0.3,0.001,0.001],kzoverkh=[.1,.1,.1],phreatictop=True,tmin=1,tmax=10,M=20,invmethod='dehoog'):
         '''z must have the length of the number of layers + 1'''
         self.storeinput(inspect.currentframe())
         kaq,H,c,Saq,Sll = param_3d(kaq,z,Saq,kzoverkh,phreatictop)
-        TimModel.__init__(self,kaq,H,c,Saq,Sll,'imp',tmin,tmax,M)
+        TimModel.__init__(self,kaq,H,c,Saq,Sll,'imp',tmin,tmax,M,invmethod)
         self.name = 'Model3D'
     
 class AquiferData:
@@ -380,15 +1021,28 @@ class AquiferData:
         self.kaq = np.atleast_1d(kaq).astype('d')
         self.Naq = len(kaq)
         self.Haq = np.atleast_1d(Haq).astype('d')
-        self.T = self.kaq * self.Haq
-        self.Tcol = self.T.reshape(self.Naq,1)
         self.c = np.atleast_1d(c).astype('d')
-        self.c[self.c > 1e100] = 1e100 
         self.Saq = np.atleast_1d(Saq).astype('d')
         self.Sll = np.atleast_1d(Sll).astype('d')
-        self.Sll[self.Sll < 1e-20] = 1e-20 # Cannot be zero
         self.topboundary = topboundary[:3]
+        self.setparameters()
+        self.changed = True  # Eigen data is computed again in an incremental solve
+    def setparameters(self):
+        self.T = self.kaq * self.Haq
+        self.Tcol = self.T.reshape(self.Naq,1)
+        self.c[self.c > 1e100] = 1e100 
+        self.Sll[self.Sll < 1e-20] = 1e-20 # Cannot be zero
         self.D = self.T / self.Saq
+    def set(self,**kwargs):
+        '''Sets kaq, Haq, c, Saq or Sll and marks the aquifer as changed, so that the eigen data and the
+        elements in the aquifer are initialized again when solving with incremental=1'''
+        for key,value in kwargs.items():
+            assert key in ['kaq','Haq','c','Saq','Sll'], "TTim error: only kaq, Haq, c, Saq and Sll of an aquifer can be set"
+            value = np.atleast_1d(value).astype('d')
+            assert value.shape == getattr(self,key).shape, "TTim error: "+key+" must have the same length as before"
+            setattr(self,key,value)
+        self.setparameters()
+        self.changed = True
     def __repr__(self):
         return 'Inhom T: ' + str(self.T)
     def initialize(self):
@@ -400,22 +1054,75 @@ class AquiferData:
         coef[Naq,Naq,Np]: Array with coefficients;
         coef[ipylayers,:,np] are the coefficients if the element is in ipylayers belonging to Laplace parameter number np
         '''
-        self.eigval = np.zeros((self.Naq,self.model.Np),'D')
-        self.lab = np.zeros((self.Naq,self.model.Np),'D')
-        self.eigvec = np.zeros((self.Naq,self.Naq,self.model.Np),'D')
-        self.coef = np.zeros((self.Naq,self.Naq,self.model.Np),'D')
-        b = np.diag(np.ones(self.Naq))
-        for i in range(self.model.Np):
-            w,v = self.compute_lab_eigvec(self.model.p[i]) # Eigenvectors are columns of v
-            index = np.argsort( abs(w) )[::-1]
-            w = w[index]; v = v[:,index]
-            self.eigval[:,i] = w; self.eigvec[:,:,i] = v
-            self.coef[:,:,i] = np.linalg.solve( v, b ).T
+        # All p values at once; w[Np,Naq], u[Np,Naq,Naq]; eigenvectors of the symmetric matrix are columns of u[i]
+        w,u = self.compute_lab_eigsymv(self.model.p)
+        index = np.argsort( abs(w), 1 )[:,::-1]
+        ip = np.arange(self.model.Np)[:,np.newaxis]
+        w = w[ip,index]; u = u[ip,:,index].swapaxes(1,2)
+        self.eigval = w.T.copy()
+        v,s = self.compute_lab_eigvecscale(u)
+        self.eigvec = v.transpose(1,2,0).copy()
+        # v = T^(1/2) u / s, and the inverse of u is its transpose, so no inverse is needed for coef
+        self.coef = ( u * s[:,np.newaxis,:] / np.sqrt(self.Tcol) ).transpose(1,2,0).copy()
         self.lab = 1.0 / np.sqrt(self.eigval)
         self.lab2 = self.lab.copy(); self.lab2.shape = (self.Naq,self.model.Nin,self.model.Npin)
         self.lababs = np.abs(self.lab2[:,:,0]) # used to check distances
     def compute_lab_eigvec(self,p):
-        sqrtpSc = np.sqrt( p * self.Sll * self.c )
+        w,v = self.compute_lab_eigvecv(np.array([p]))
+        return w[0],v[0]
+    def compute_lab_eigvecv(self,p):
+        '''Returns eigenvalues w[Np,Naq] and eigenvectors v[Np,Naq,Naq] for array p[Np]'''
+        w,u = self.compute_lab_eigsymv(p)
+        return w, self.compute_lab_eigvecscale(u)[0]
+    def compute_lab_eigvecscale(self,u):
+        '''Returns eigenvectors v[Np,Naq,Naq] = T^(1/2) u / s and scale factors s[Np,Naq]
+        The columns of v are scaled as by np.linalg.eig: unit norm and the largest component real'''
+        v = u * np.sqrt(self.Tcol)
+        k = np.argmax( np.abs(v), 1 )
+        vk = v[ np.arange(len(v))[:,np.newaxis], k, np.arange(self.Naq) ]
+        v = v / vk[:,np.newaxis,:]  # Exactly 1 for a single aquifer
+        norm = np.sqrt( np.sum( np.abs(v)**2, 1 ) )
+        return v / norm[:,np.newaxis,:], vk * norm
+    def compute_lab_eigsymv(self,p):
+        '''Returns eigenvalues w[Np,Naq] and eigenvectors u[Np,Naq,Naq] of the symmetric matrices for array p[Np]
+        The eigenvectors are scaled such that u.T u = I, so the inverse of u is its transpose'''
+        if self.Naq == 1:
+            d,e = self.compute_lab_tridiag(p)
+            return d, np.ones((len(p),1,1),'D')
+        if self.peigvecinvariant(p):
+            # eigenvectors do not depend on p; eigenvalues are shifted by p/D
+            d,e = self.compute_lab_tridiag(p[:1])
+            d = ( d[0] - p[0] / self.D ).real; e = e[0].real
+            w0,u0 = np.linalg.eigh( np.diag(d) + np.diag(e,1) + np.diag(e,-1) )
+            w = p[:,np.newaxis] / self.D[0] + w0
+            u = np.empty((len(p),self.Naq,self.Naq),'D'); u[:] = u0
+            return w,u
+        d,e = self.compute_lab_tridiag(p)
+        w,u,info = tridiageigen.tridiageigv(d,e)
+        bad = info != 0
+        if np.any(bad): # QL did not converge; use dense eig and scale the eigenvectors
+            A = np.zeros((np.sum(bad),self.Naq,self.Naq),'D')
+            irow = np.arange(self.Naq)
+            A[:,irow,irow] = d[bad]
+            A[:,irow[1:],irow[:-1]] = e[bad]
+            A[:,irow[:-1],irow[1:]] = e[bad]
+            wb,ub = np.linalg.eig(A)
+            w[bad] = wb
+            u[bad] = ub / np.sqrt( np.sum( ub * ub, 1 ) )[:,np.newaxis,:]
+        return w,u
+    def peigvecinvariant(self,p):
+        '''Returns True when the eigenvectors do not depend on p:
+        all layers have the same diffusivity and storage in the leaky layers is negligible'''
+        if not np.allclose( self.D, self.D[0], rtol=1e-12, atol=0.0 ): return False
+        if (self.topboundary == 'sem') or (self.topboundary == 'lea'):
+            pSc = np.abs(p).max() * self.Sll * self.c
+        else:
+            pSc = np.abs(p).max() * self.Sll[1:] * self.c[1:]
+        return np.all( pSc < 1e-14 )
+    def compute_lab_tridiag(self,p):
+        '''Returns diagonal d[Np,Naq] and off-diagonal e[Np,Naq-1] of the complex symmetric matrices
+        T^(-1/2) A T^(1/2), which have the same eigenvalues as the system matrices A'''
+        sqrtpSc = np.sqrt( p[:,np.newaxis] * self.Sll * self.c )
         a, b = np.zeros_like(sqrtpSc), np.zeros_like(sqrtpSc)
         small = np.abs(sqrtpSc) < 200
         a[small] = sqrtpSc[small] / np.tanh(sqrtpSc[small])
@@ -423,23 +1130,20 @@ class AquiferData:
         a[~small] = sqrtpSc[~small] / ( (1.0 - np.exp(-2.0*sqrtpSc[~small])) / (1.0 + np.exp(-2.0*sqrtpSc[~small])) )
         b[~small] = sqrtpSc[~small] * 2.0 * np.exp(-sqrtpSc[~small]) / (1.0 - np.exp(-2.0*sqrtpSc[~small]))
         if (self.topboundary == 'sem') or (self.topboundary == 'lea'):
-            if abs(sqrtpSc[0]) < 200:
-                dzero = sqrtpSc[0] * np.tanh( sqrtpSc[0] )
-            else:
-                dzero = sqrtpSc[0] * cmath_tanh( sqrtpSc[0] )  # Bug in complex tanh in numpy
-        d0 = p / self.D
-        d0[:-1] += a[1:] / (self.c[1:] * self.T[:-1])
-        d0[1:]  += a[1:] / (self.c[1:] * self.T[1:])
+            dzero = np.zeros_like(sqrtpSc[:,0])
+            small0 = small[:,0]
+            dzero[small0] = sqrtpSc[small0,0] * np.tanh( sqrtpSc[small0,0] )
+            dzero[~small0] = sqrtpSc[~small0,0] * (1.0 - np.exp(-2.0*sqrtpSc[~small0,0])) / (1.0 + np.exp(-2.0*sqrtpSc[~small0,0]))  # Bug in complex tanh in numpy
+        d0 = p[:,np.newaxis] / self.D
+        d0[:,:-1] += a[:,1:] / (self.c[1:] * self.T[:-1])
+        d0[:,1:]  += a[:,1:] / (self.c[1:] * self.T[1:])
         if self.topboundary == 'lea':
-            d0[0] += dzero / ( self.c[0] * self.T[0] )
+            d0[:,0] += dzero / ( self.c[0] * self.T[0] )
         elif self.topboundary == 'sem':
-            d0[0] += a[0] / ( self.c[0] * self.T[0] )
+            d0[:,0] += a[:,0] / ( self.c[0] * self.T[0] )
             
-        dm1 = -b[1:] / (self.c[1:] * self.T[:-1])
-        dp1 = -b[1:] / (self.c[1:] * self.T[1:])
-        A = np.diag(dm1,-1) + np.diag(d0,0) + np.diag(dp1,1)
-        w,v = np.linalg.eig(A)
-        return w,v
+        e = -b[:,1:] / ( self.c[1:] * np.sqrt( self.T[:-1] * self.T[1:] ) )
+        return d0,e
     def headToPotential(self,h,pylayers):
         return h * self.Tcol[pylayers]
     def potentialToHead(self,pot,pylayers):
@@ -452,6 +1156,7 @@ class Aquifer(AquiferData):
     def __init__(self,model,kaq,Haq,c,Saq,Sll,topboundary):
         AquiferData.__init__(self,model,kaq,Haq,c,Saq,Sll,topboundary)
         self.inhomList = []
+        self.inhomindex = None
         self.area = 1e300 # Needed to find smallest inhomogeneity
     def __repr__(self):
         return 'Background Aquifer T: ' + str(self.T)
@@ -459,13 +1164,64 @@ class Aquifer(AquiferData):
         AquiferData.initialize(self)
         for inhom in self.inhomList:
             inhom.initialize()
+        self.setinhomindex()
+    def setinhomindex(self):
+        '''Uniform grid over the bounding boxes of the inhomogeneities with about one inhomogeneity per cell.
+        inhomindex is (x0,y0,dx,dy,nx,ny,cells) where cells[i,j] is an array with the numbers of the
+        inhomogeneities that overlap cell i,j ordered from small to large area'''
+        if len(self.inhomList) == 0:
+            self.inhomindex = ()
+            return
+        bbox = np.array([ inhom.boundingbox() for inhom in self.inhomList ])
+        x0, x1, y0, y1 = bbox[:,0].min(), bbox[:,1].max(), bbox[:,2].min(), bbox[:,3].max()
+        nx = ny = int(np.ceil(np.sqrt(len(self.inhomList))))
+        dx, dy = max( (x1-x0)/nx, 1e-300 ), max( (y1-y0)/ny, 1e-300 )
+        order = np.argsort([ inhom.area for inhom in self.inhomList ],kind='mergesort')  # Equal areas stay in list order
+        cells = [ [ [] for j in range(ny) ] for i in range(nx) ]
+        for k in order:
+            i0, i1 = [ min( int((bx-x0)/dx), nx-1 ) for bx in bbox[k,:2] ]
+            j0, j1 = [ min( int((by-y0)/dy), ny-1 ) for by in bbox[k,2:] ]
+            for i in range(i0,i1+1):
+                for j in range(j0,j1+1): cells[i][j].append(k)
+        cellarray = np.empty( (nx,ny), 'O' )
+        for i in range(nx):
+            for j in range(ny): cellarray[i,j] = np.array(cells[i][j],'i')
+        self.inhomindex = (x0,y0,dx,dy,nx,ny,cellarray)
+    def findcell(self,x,y):
+        '''Returns cell numbers i,j of the inhomindex for points x,y; i is -1 outside the grid'''
+        x0,y0,dx,dy,nx,ny,cells = self.inhomindex
+        i, j = np.floor( (x-x0)/dx ).astype('i'), np.floor( (y-y0)/dy ).astype('i')
+        # Points on the right and top edges of the grid are in the last cell
+        i[ (i == nx) & (x <= x0 + nx*dx) ] = nx-1
+        j[ (j == ny) & (y <= y0 + ny*dy) ] = ny-1
+        i[ (i < 0) | (i >= nx) | (j < 0) | (j >= ny) ] = -1
+        return i,j
     def findAquiferData(self,x,y):
-        rv = self
-        for aq in self.inhomList:
-            if aq.isInside(x,y):
-                if aq.area < rv.area:
-                    rv = aq
-        return rv
+        '''Returns the smallest inhomogeneity that contains x,y or the background aquifer'''
+        if self.inhomindex is None: self.setinhomindex()
+        if len(self.inhomList) == 0: return self
+        i,j = self.findcell(np.atleast_1d(x),np.atleast_1d(y))
+        if i[0] < 0: return self
+        for k in self.inhomindex[6][i[0],j[0]]:
+            if self.inhomList[k].isInside(x,y): return self.inhomList[k]
+        return self
+    def findAquiferDatav(self,x,y):
+        '''Returns array iaq with the number of the aquifer of points x,y in [self] + inhomList'''
+        if self.inhomindex is None: self.setinhomindex()
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        iaq = np.zeros(len(x),'i')
+        if len(self.inhomList) == 0: return iaq
+        i,j = self.findcell(x,y)
+        nx,ny,cells = self.inhomindex[4:]
+        cellnumber = np.where( i < 0, -1, i*ny + j )
+        for icell in np.unique(cellnumber[cellnumber >= 0]):
+            ind = np.nonzero( cellnumber == icell )[0]
+            for k in cells[icell//ny,icell%ny]:
+                inside = self.inhomList[k].isInside(x[ind],y[ind])
+                iaq[ind[inside]] = k + 1
+                ind = ind[~inside]
+                if len(ind) == 0: break
+        return iaq
     
 class CircInhomData(AquiferData):
     def __init__(self,model,x0=0,y0=0,R=1,kaq=[1],Haq=[1],c=[1],Saq=[.1],Sll=[.1],topboundary='imp'):
@@ -475,9 +1231,10 @@ class CircInhomData(AquiferData):
         self.area = np.pi * self.Rsq
         self.model.addInhom(self)
     def isInside(self,x,y):
-        rv = False
-        if (x-self.x0)**2 + (y-self.y0)**2 < self.Rsq: rv = True
-        return rv
+        '''Works for scalars and arrays of points'''
+        return (x-self.x0)**2 + (y-self.y0)**2 < self.Rsq
+    def boundingbox(self):
+        return self.x0 - self.R, self.x0 + self.R, self.y0 - self.R, self.y0 + self.R
 
 class CircInhomDataMaq(CircInhomData):
     def __init__(self,model,x0=0,y0=0,R=1,kaq=[1],z=[1,0],c=[],Saq=[0.001],Sll=[0],topboundary='imp',phreatictop=False):
@@ -508,8 +1265,13 @@ class EllipseInhomDataMaq(AquiferData):
         # q = -L^2 / (4^2 * lab^2) where L is focal length
         self.q =  self.dfoc**2 / (16.0 * self.lab**2)
     def isInside(self,x,y):
+        '''Works for scalars and arrays of points'''
         eta,psi = self.xytoetapsi(x,y)
         return eta < self.etastar
+    def boundingbox(self):
+        hx = np.sqrt( (self.along * self.cosal)**2 + (self.bshort * self.sinal)**2 )
+        hy = np.sqrt( (self.along * self.sinal)**2 + (self.bshort * self.cosal)**2 )
+        return self.x0 - hx, self.x0 + hx, self.y0 - hy, self.y0 + hy
     def xytoetapsi(self,x,y):
         Z = (x+y*1j - self.z0) * np.exp( -1j * self.angle )
         tau = np.log( Z / self.afoc + np.sqrt( Z/self.afoc - 1 ) * np.sqrt( Z/self.afoc + 1 ) )
@@ -529,6 +1291,241 @@ class EllipseInhomDataMaq(AquiferData):
         alpha = np.arctan2( np.cosh(eta)*np.sin(psi), np.sinh(eta)*np.cos(psi) ) + self.angle
         return alpha
   
+def unionbox(boxes):
+    '''Returns the box (xmin,xmax,ymin,ymax) around all boxes, or None when one of the boxes is None'''
+    if None in boxes: return None
+    boxes = np.array(boxes)
+    return boxes[:,0].min(), boxes[:,1].max(), boxes[:,2].min(), boxes[:,3].max()
+
+class GivenElementGroup:
+    '''Given elements with the same tstart and bc that differ by a scale factor only.
+    The group is one column of the right-hand side; bc is the bc of the first element and the
+    unit functions are the sum of the unit functions of the elements times their scale'''
+    def __init__(self,model,tstart,bc,elements,scales):
+        self.model = model
+        self.tstart, self.bc, self.Ntstart = tstart, bc, len(tstart)
+        self.elements = elements
+        self.scales = scales
+    def __repr__(self):
+        return 'GivenElementGroup with ' + str(len(self.elements)) + ' elements'
+    def reach(self):
+        return unionbox([ e.reach() for e in self.elements ])
+    def unitpotential(self,x,y,aq=None):
+        if aq is None: aq = self.model.aq.findAquiferData(x,y)
+        return np.sum( [ s * e.unitpotential(x,y,aq) for e,s in zip(self.elements,self.scales) ], 0 )
+    def unitdischarge(self,x,y,aq=None):
+        if aq is None: aq = self.model.aq.findAquiferData(x,y)
+        q = [ e.unitdischarge(x,y,aq) for e in self.elements ]
+        return np.sum( [ s * qx for (qx,qy),s in zip(q,self.scales) ], 0 ), np.sum( [ s * qy for (qx,qy),s in zip(q,self.scales) ], 0 )
+    def unitpotentiallayers(self,x,y,pylayers=0,aq=None):
+        if aq is None: aq = self.model.aq.findAquiferData(x,y)
+        return np.sum( [ s * e.unitpotentiallayers(x,y,pylayers,aq) for e,s in zip(self.elements,self.scales) ], 0 )
+    def unitdischargelayers(self,x,y,pylayers=0,aq=None):
+        if aq is None: aq = self.model.aq.findAquiferData(x,y)
+        q = [ e.unitdischargelayers(x,y,pylayers,aq) for e in self.elements ]
+        return np.sum( [ s * qx for (qx,qy),s in zip(q,self.scales) ], 0 ), np.sum( [ s * qy for (qx,qy),s in zip(q,self.scales) ], 0 )
+    def unitpotentiallayersv(self,x,y,pylayers=0,aq=None):
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = self.scales[0] * self.elements[0].unitpotentiallayersv(x,y,pylayers,aq)
+        for e,s in zip(self.elements[1:],self.scales[1:]):
+            rv += s * e.unitpotentiallayersv(x,y,pylayers,aq)
+        return rv
+    def unitdischargelayersv(self,x,y,pylayers=0,aq=None):
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = self.elements[0].unitdischargelayersv(x,y,pylayers,aq)
+        qx,qy = self.scales[0] * qx, self.scales[0] * qy
+        for e,s in zip(self.elements[1:],self.scales[1:]):
+            qxe,qye = e.unitdischargelayersv(x,y,pylayers,aq)
+            qx += s * qxe; qy += s * qye
+        return qx,qy
+    def unitpotentialv(self,x,y,aq=None):
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = self.scales[0] * self.elements[0].unitpotentialv(x,y,aq)
+        for e,s in zip(self.elements[1:],self.scales[1:]):
+            rv += s * e.unitpotentialv(x,y,aq)
+        return rv
+    def unitdischargev(self,x,y,aq=None):
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = self.elements[0].unitdischargev(x,y,aq)
+        qx,qy = self.scales[0] * qx, self.scales[0] * qy
+        for e,s in zip(self.elements[1:],self.scales[1:]):
+            qxe,qye = e.unitdischargev(x,y,aq)
+            qx += s * qxe; qy += s * qye
+        return qx,qy
+
+class ElementCluster:
+    '''Cluster of elements with unknowns for the hierarchical matrix; blocks is a list of (element,ieq).
+    The box is the bounding box of the control points. A cluster with more than leafsize unknowns is split
+    in two halves of the elements along the longest side of the box'''
+    def __init__(self,blocks,leafsize):
+        self.blocks = blocks
+        self.elements = [ e for e,ieq in blocks ]
+        self.index = np.hstack([ np.arange(ieq,ieq+e.Nunknowns) for e,ieq in blocks ])
+        x = np.hstack([ e.xc for e in self.elements ]); y = np.hstack([ e.yc for e in self.elements ])
+        self.xmin, self.xmax, self.ymin, self.ymax = x.min(), x.max(), y.min(), y.max()
+        self.children = None
+        if (len(self.index) > leafsize) and (len(blocks) > 1):
+            if self.xmax - self.xmin >= self.ymax - self.ymin:
+                center = [ np.mean(e.xc) for e in self.elements ]
+            else:
+                center = [ np.mean(e.yc) for e in self.elements ]
+            order = np.argsort(center,kind='mergesort')
+            half = len(blocks) // 2
+            self.children = [ ElementCluster([ blocks[i] for i in order[:half] ],leafsize),
+                              ElementCluster([ blocks[i] for i in order[half:] ],leafsize) ]
+    def diameter(self):
+        return np.hypot( self.xmax - self.xmin, self.ymax - self.ymin )
+    def distance(self,other):
+        dx = max( 0.0, other.xmin - self.xmax, self.xmin - other.xmax )
+        dy = max( 0.0, other.ymin - self.ymax, self.ymin - other.ymax )
+        return np.hypot(dx,dy)
+
+class HMatrix:
+    '''Hierarchical matrix with the equations of all p values of the model.
+    Blocks between clusters that are well separated (largest diameter smaller than eta times the distance)
+    are stored as low-rank products U V for every p, computed with adaptive cross approximation with
+    relative tolerance tol, so that only a few rows and columns of these blocks are built.
+    All other blocks are built and stored in one sparse matrix per p, which is also used as preconditioner.
+    This is not a hierarchical LU: the preconditioner is a sparse LU of the near field of every p, whose fill
+    depends on the layout of the elements, and the ranks of the far blocks grow with their size for the
+    complex p values, so the storage grows faster than N log N (see storage)'''
+    def __init__(self,model,leafsize=32,eta=1.0,tol=1e-10):
+        self.model = model
+        blocks,self.Neq = model.equationblocks()
+        self.ieq = dict(blocks)
+        self.tree = ElementCluster(blocks,leafsize)
+        self.nearblocks, self.farblocks = [], []
+        self.partition(self.tree,self.tree,eta)
+        self.rhs = np.empty( (model.Np,self.Neq,model.Ngvbc), 'D' )
+        for e,ieq in blocks:
+            self.rhs[ :, ieq:ieq+e.Nunknowns, : ] = e.equationrhs().transpose(2,0,1)
+        self.buildnear()
+        self.far = [ self.aca(r,c,tol) for r,c in self.farblocks ]
+    def partition(self,r,c,eta):
+        if max(r.diameter(),c.diameter()) < eta * r.distance(c):
+            self.farblocks.append( (r,c) )
+        elif (r.children is None) and (c.children is None):
+            self.nearblocks.append( (r,c) )
+        elif (c.children is None) or ( (r.children is not None) and (len(r.index) >= len(c.index)) ):
+            for rc in r.children: self.partition(rc,c,eta)
+        else:
+            for cc in c.children: self.partition(r,cc,eta)
+    def columnindex(self,c):
+        '''Returns the columns of the elements of cluster c in the order of equation(columns) and their matrix columns'''
+        colblocks = self.model.equationblocks(c.elements)[0]
+        return colblocks, np.hstack([ np.arange(self.ieq[e],self.ieq[e]+e.Nunknowns) for e,jcol in colblocks ])
+    def buildnear(self):
+        rows, cols, vals = [], [], []
+        for r,c in self.nearblocks:
+            colindex = self.columnindex(c)[1]
+            for e,ieq in r.blocks:
+                emat = e.equation(c.elements)[0]
+                rows.append( np.repeat(np.arange(ieq,ieq+e.Nunknowns),len(colindex)) )
+                cols.append( np.tile(colindex,e.Nunknowns) )
+                vals.append( emat.reshape(-1,self.model.Np) )
+        rows, cols, vals = np.hstack(rows), np.hstack(cols), np.vstack(vals)
+        self.near = [ scipy.sparse.csc_matrix( (vals[:,i],(rows,cols)), shape=(self.Neq,self.Neq) ) for i in range(self.model.Np) ]
+    def aca(self,r,c,tol):
+        '''Returns the rows and columns of block (r,c) and lists with U[m,k] and V[k,n] for every p.
+        When the rank k is so large that U and V are larger than the block, U is the block and V is None.
+        Rows of an element (with equation(columns)) and columns of an element are built once for all p
+        when the pivoting of one of the p values needs them'''
+        colblocks, colindex = self.columnindex(c)
+        m, n = len(r.index), len(colindex)
+        rowsize = [ e.Nunknowns for e in r.elements ]; rowstart = np.cumsum([0] + rowsize)
+        colsize = [ e.Nunknowns for e,jcol in colblocks ]; colstart = np.cumsum([0] + colsize)
+        rowelement = np.repeat(np.arange(len(rowsize)),rowsize); colelement = np.repeat(np.arange(len(colsize)),colsize)
+        # Rows are tried starting with the elements closest to the center of c
+        xc, yc = 0.5 * (c.xmin + c.xmax), 0.5 * (c.ymin + c.ymax)
+        dist = [ np.min(np.hypot(e.xc-xc,e.yc-yc)) for e in r.elements ]
+        rowelementorder = np.argsort(dist,kind='mergesort')
+        # Rows of elements with all control points outside the reach of the elements of c are zero for all p (see Element.reach);
+        # all other rows are tried after a zero row before the block is considered done
+        boxes = [ e.reach() for e,jcol in colblocks ]
+        def reached(e):
+            return np.any([ (box is None) or np.any( (e.xc >= box[0]) & (e.xc <= box[1]) & (e.yc >= box[2]) & (e.yc <= box[3]) ) for box in boxes ])
+        candidates = np.hstack([ np.arange(rowstart[k],rowstart[k+1]) for k in rowelementorder if reached(r.elements[k]) ] + [ np.zeros(0,'i') ]).astype('i')
+        rowcache, colcache = {}, {}
+        def row(i,ip):
+            k = rowelement[i]
+            if k not in rowcache: rowcache[k] = r.elements[k].equation(c.elements)[0]
+            return rowcache[k][i-rowstart[k],:,ip]
+        def column(j,ip):
+            k = colelement[j]
+            if k not in colcache: colcache[k] = np.vstack([ e.equation([colblocks[k][0]])[0] for e in r.elements ])
+            return colcache[k][:,j-colstart[k],ip]
+        U, V = [], []
+        for ip in range(self.model.Np):
+            u, v = np.zeros((m,0),'D'), np.zeros((0,n),'D')
+            used = np.zeros(m,'bool')
+            used[ np.setdiff1d(np.arange(m),candidates) ] = True
+            norm2 = 0.0
+            i = candidates[0] if len(candidates) > 0 else None
+            while (i is not None) and (u.shape[1] < min(m,n)):
+                used[i] = True
+                res = row(i,ip) - np.dot(u[i],v)
+                j = np.argmax(np.abs(res))
+                if res[j] == 0.0:
+                    # Zero row, for example beyond Rzero for this p; continue with the next row that is not used
+                    unused = candidates[ ~used[candidates] ]
+                    i = unused[0] if len(unused) > 0 else None
+                    continue
+                vnew = res / res[j]
+                unew = column(j,ip) - np.dot(u,v[:,j])
+                norm2 += 2.0 * np.real( np.dot( np.dot(u.conj().T,unew), np.dot(v.conj(),vnew) ) ) + \
+                         np.linalg.norm(unew)**2 * np.linalg.norm(vnew)**2
+                u = np.hstack(( u, unew[:,np.newaxis] )); v = np.vstack(( v, vnew[np.newaxis,:] ))
+                if np.linalg.norm(unew) * np.linalg.norm(vnew) <= tol * np.sqrt(abs(norm2)): break
+                if np.all(used): break
+                i = np.argmax( np.where(used,-1.0,np.abs(unew)) )
+            if u.shape[1] * (m + n) >= m * n:
+                U.append(np.dot(u,v)); V.append(None)  # Stored as a full block when that is smaller
+            else:
+                U.append(u); V.append(v)
+        return r.index, colindex, U, V
+    def matvec(self,ip,x):
+        y = self.near[ip].dot(x)
+        for rows,cols,U,V in self.far:
+            if V[ip] is None:
+                y[rows] += np.dot( U[ip], x[cols] )
+            elif U[ip].shape[1] > 0:
+                y[rows] += np.dot( U[ip], np.dot(V[ip],x[cols]) )
+        return y
+    def storage(self):
+        '''Returns the number of stored entries as a fraction of the entries of the full matrices'''
+        stored = np.sum([ a.nnz for a in self.near ]) + np.sum([ U[ip].size + getattr(V[ip],'size',0) for rows,cols,U,V in self.far for ip in range(self.model.Np) ])
+        return stored / float( self.model.Np * self.Neq**2 )
+    def solve(self,tol=1e-10,maxiter=100):
+        '''Returns sol[Np,Neq,Ngvbc] computed with gmres, preconditioned with the LU factorization of the sparse near field.
+        The solution of the previous p is the initial guess within an interval; iterations[Np,Ngvbc] stores the number of iterations.
+        When gmres does not converge within maxiter restarts, the full matrix of that p is built and solved directly
+        as in TimModel.solveiterative; iterations is -1 for these p values'''
+        sol = np.zeros_like(self.rhs)
+        self.iterations = np.zeros( (self.model.Np,self.model.Ngvbc), 'i' )
+        mat = None
+        for ip in range(self.model.Np):
+            lu = scipy.sparse.linalg.splu(self.near[ip])
+            M = scipy.sparse.linalg.LinearOperator( (self.Neq,self.Neq), matvec=lu.solve, dtype='D' )
+            A = scipy.sparse.linalg.LinearOperator( (self.Neq,self.Neq), matvec=lambda x,ip=ip: self.matvec(ip,x), dtype='D' )
+            info = 0
+            for k in range(self.model.Ngvbc):
+                if not np.any(self.rhs[ip,:,k]): continue
+                x0 = sol[ip-1,:,k] if ip % self.model.Npin > 0 else M.matvec(self.rhs[ip,:,k])
+                count = [0]
+                def callback(rk): count[0] += 1
+                sol[ip,:,k],info = scipy.sparse.linalg.gmres( A, self.rhs[ip,:,k], x0=x0, tol=tol, maxiter=maxiter, M=M, callback=callback )
+                self.iterations[ip,k] = count[0]
+                if info != 0: break
+            if info != 0:
+                if mat is None: mat = self.model.assemble()[0]  # Built once, only when needed
+                sol[ip] = np.linalg.solve( mat[ip], self.rhs[ip] )
+                self.iterations[ip] = -1
+        return sol
+
 class Element:
     def __init__(self, model, Nparam=1, Nunknowns=0, layers=1, tsandbc=[(0.0,0.0)], type='z', name='', label=None):
         '''Types of elements
@@ -549,18 +1546,27 @@ class Element:
         self.pylayers = self.layers - 1
         self.Nlayers = len(self.layers)
         #
-        tsandbc = np.atleast_2d(tsandbc).astype('d')
-        assert tsandbc.shape[1] == 2, "TTim input error: tsandQ or tsandh need to be 2D lists or arrays like [(0,1),(2,5),(8,0)] "
-        self.tstart,self.bcin = tsandbc[:,0],tsandbc[:,1]
-        if self.tstart[0] > 0:
-            self.tstart = np.hstack((np.zeros(1),self.tstart))
-            self.bcin = np.hstack((np.zeros(1),self.bcin))
+        self.settsandbc(tsandbc)
         #
         self.type = type  # 'z' boundary condition through time or 'v' boundary condition through time
         self.name = name
         self.label = label
         if self.label is not None: assert self.label not in self.model.elementDict.keys(), "TTim error: label "+self.label+" already exists"
         self.Rzero = 30.0
+        self.changed = True  # Initialized again in an incremental solve
+    def set(self,**kwargs):
+        '''Sets attributes of the element, for example ls.set(res=2.0), and marks the element as changed,
+        so that it is initialized again when solving with incremental=1'''
+        for key,value in kwargs.items():
+            setattr(self,key,value)
+        self.changed = True
+    def settsandbc(self,tsandbc):
+        tsandbc = np.atleast_2d(tsandbc).astype('d')
+        assert tsandbc.shape[1] == 2, "TTim input error: tsandQ or tsandh need to be 2D lists or arrays like [(0,1),(2,5),(8,0)] "
+        self.tstart,self.bcin = tsandbc[:,0],tsandbc[:,1]
+        if self.tstart[0] > 0:
+            self.tstart = np.hstack((np.zeros(1),self.tstart))
+            self.bcin = np.hstack((np.zeros(1),self.bcin))
     def setbc(self):
         if len(self.tstart) > 1:
             self.bc = np.zeros_like(self.bcin)
@@ -645,30 +1651,121 @@ class Element:
         qx,qy = self.unitdischarge(x,y,aq)
         rvx = np.sum( qx[np.newaxis,:,:] * aq.eigvec, 1 ); rvy = np.sum( qy[np.newaxis,:,:] * aq.eigvec, 1 )
         return rvx[pylayers,:], rvy[pylayers,:]
+    # Functions for many points at once; all points must be in the same aquifer aq
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)
+        Loops over the points; should be overloaded by elements that can do better'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        for i in range(len(x)):
+            rv[:,:,:,i] = self.potinf(x[i],y[i],aq)
+        return rv
+    def potentialv(self,x,y,aq=None):
+        '''Returns complex array of size (Ngvbc,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        return np.sum( self.parameters[:,:,np.newaxis,:,np.newaxis] * self.potinfv(x,y,aq), 1 )
+    def unitpotentialv(self,x,y,aq=None):
+        '''Returns complex array of size (Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        return np.sum( self.potinfv(x,y,aq), 0 )
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)
+        Loops over the points; should be overloaded by elements that can do better'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rvx,rvy = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D'), np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        for i in range(len(x)):
+            rvx[:,:,:,i],rvy[:,:,:,i] = self.disinf(x[i],y[i],aq)
+        return rvx,rvy
+    def dischargev(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Ngvbc,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = self.disinfv(x,y,aq)
+        return np.sum( self.parameters[:,:,np.newaxis,:,np.newaxis] * qx, 1 ), np.sum( self.parameters[:,:,np.newaxis,:,np.newaxis] * qy, 1 )
+    def unitdischargev(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = self.disinfv(x,y,aq)
+        return np.sum( qx, 0 ), np.sum( qy, 0 )
+    def potinflayersv(self,x,y,pylayers=0,aq=None):
+        '''pylayers can be scalar, list, or array. returns array of size (len(pylayers),Nparam,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        pot = self.potinfv(x,y,aq)
+        rv = np.sum( pot[:,np.newaxis,:,:,:] * aq.eigvec[:,:,:,np.newaxis], 2 )
+        rv = rv.swapaxes(0,1) # As the first axes needs to be the number of layers
+        return rv[pylayers,:]
+    def unitpotentiallayersv(self,x,y,pylayers=0,aq=None):
+        '''Returns complex array of size (len(pylayers),Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        pot = self.unitpotentialv(x,y,aq)
+        phi = np.sum( pot[np.newaxis,:,:,:] * aq.eigvec[:,:,:,np.newaxis], 1 )
+        return phi[pylayers,:]
+    def disinflayersv(self,x,y,pylayers=0,aq=None):
+        '''pylayers can be scalar, list, or array. returns 2 arrays of size (len(pylayers),Nparam,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = self.disinfv(x,y,aq)
+        rvx = np.sum( qx[:,np.newaxis,:,:,:] * aq.eigvec[:,:,:,np.newaxis], 2 ); rvy = np.sum( qy[:,np.newaxis,:,:,:] * aq.eigvec[:,:,:,np.newaxis], 2 )
+        rvx = rvx.swapaxes(0,1); rvy = rvy.swapaxes(0,1) # As the first axes needs to be the number of layers
+        return rvx[pylayers,:], rvy[pylayers,:]
+    def unitdischargelayersv(self,x,y,pylayers=0,aq=None):
+        '''Returns 2 complex arrays of size (len(pylayers),Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = self.unitdischargev(x,y,aq)
+        rvx = np.sum( qx[np.newaxis,:,:,:] * aq.eigvec[:,:,:,np.newaxis], 1 ); rvy = np.sum( qy[np.newaxis,:,:,:] * aq.eigvec[:,:,:,np.newaxis], 1 )
+        return rvx[pylayers,:], rvy[pylayers,:]
+    def layerscp(self,func,x,y,aq=None):
+        '''Returns func(x,y,self.pylayers,aq) for all points x,y at once with the points as first axis,
+        so an array of size (Npts,Nlayers,...) or a tuple of those; func is one of the layersv functions.
+        The points are grouped by aquifer, unless aq is given. Used to build equations'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None:
+            groups = self.model.aquifergroups(x,y)
+        else:
+            groups = [ (aq,np.ones(len(x),'bool')) ]
+        rv = None
+        for aq,ind in groups:
+            r = func(x[ind],y[ind],self.pylayers,aq)
+            single = not isinstance(r,tuple)
+            if single: r = (r,)
+            if rv is None: rv = [ np.empty((len(x),)+ri.shape[:-1],'D') for ri in r ]
+            for rvi,ri in zip(rv,r): rvi[ind] = np.rollaxis(ri,-1)
+        if single: return rv[0]
+        return tuple(rv)
     # Other functions
     def strength(self,t,derivative=0):
-        '''returns array of strengths (Nlayers,len(t)) t must be ordered and tmin <= t <= tmax'''
+        '''returns array of strengths (Nlayers,len(t)) tmin <= t <= tmax; t may be unordered'''
         # Could potentially be more efficient if s is pre-computed for all elements, but I don't know if that is worthwhile to store as it is quick now
         time = np.atleast_1d(t).copy()
         rv = np.zeros((self.Nlayers,np.size(time)))
+        key = ('strength',self,derivative)
         if self.type == 'g':
-            s = self.strengthinflayers * self.model.p ** derivative
-            for itime in range(self.Ntstart):
-                time -=  self.tstart[itime]
-                for i in range(self.Nlayers):
-                    rv[i] += self.bc[itime] * self.model.inverseLapTran(s[i],time)
+            d = self.model.invlapcache.get(key)
+            if d is None:
+                s = self.strengthinflayers * self.model.p ** derivative
+                d = self.model.invlapprepare(s)
+                self.model.invlapcache.put(key,d)
+            # Times of all tstart values are inverted at once
+            tshift = ( time[np.newaxis,:] - self.tstart[:,np.newaxis] ).ravel()
+            for i in range(self.Nlayers):
+                rv[i] = np.dot( self.bc, self.model.inverseLapTran(None,tshift,d[i]).reshape(self.Ntstart,len(time)) )
         else:
-            s = np.sum( self.parameters[:,:,np.newaxis,:] * self.strengthinf, 1 )
-            s = np.sum( s[:,np.newaxis,:,:] * self.aq.eigvec, 2 )
-            s = s[:,self.pylayers,:] * self.model.p ** derivative
-            for k in range(self.model.Ngvbc):
-                e = self.model.gvbcList[k]
-                for itime in range(e.Ntstart):
-                    t = time - e.tstart[itime]
-                    #print 'e,time ',e,t
-                    if t[-1] >= self.model.tmin:  # Otherwise all zero
-                        for i in range(self.Nlayers):
-                            rv[i] += e.bc[itime] * self.model.inverseLapTran(s[k,i],t)
+            d = self.model.invlapcache.get(key)
+            if d is None:
+                s = np.sum( self.parameters[:,:,np.newaxis,:] * self.strengthinf, 1 )
+                s = np.sum( s[:,np.newaxis,:,:] * self.aq.eigvec, 2 )
+                s = s[:,self.pylayers,:] * self.model.p ** derivative
+                d = self.model.invlapprepare(s)
+                self.model.invlapcache.put(key,d)
+            rv = self.model.inverseLapTranGvbc(None,time,d)
         return rv
         
     #def potential(self,x,y,t,pylayers=None,aq=None,derivative=0,returnphi=0):
@@ -721,6 +1818,10 @@ class Element:
     def headinside(self,t):
         print "This function not implemented for this element"
         return
+    def reach(self):
+        '''Returns (xmin,xmax,ymin,ymax) of a box outside of which the influence of the element is zero,
+        or None when that is not known; see TimModel.setelementindex'''
+        return None
     def layout(self):
         return '','',''
     def storeinput(self,frame):
@@ -743,7 +1844,7 @@ class Element:
         pass
     
 class HeadEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for head-specified conditions. (really written as constant potential element)
         Works for Nunknowns = 1
         Returns matrix part Nunknowns,Neq,Np, complex
@@ -752,105 +1853,134 @@ class HeadEquation:
         Well: q_s = Q / (2*pi*r_w*H)
         LineSink: q_s = sigma / H = Q / (L*H)
         '''
-        mat = np.empty( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.empty( (self.Nunknowns,Ncol,self.model.Np), 'D' )
+        # Views with control point and layer as separate axes; row icp*Nlayers+i is [icp,i]
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        for e,ieq in blocks:
+            mat4[:,:,ieq:ieq+e.Nunknowns,:] = self.layerscp(e.potinflayersv,self.xc,self.yc)
+            if e == self:
+                for i in range(self.Nunknowns): mat[i,ieq+i,:] -= self.resfacp[i] * e.strengthinflayers[i]
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0  
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] = e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers)
-                    if e == self:
-                        for i in range(self.Nlayers): mat[istart+i,ieq+istart+i,:] -= self.resfacp[istart+i] * e.strengthinflayers[istart+i]
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                rhs[istart:istart+self.Nlayers,i,:] -= self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers)  # Pretty cool that this works, really
-            if self.type == 'v':
-                iself = self.model.vbcList.index(self)
-                for i in range(self.Nlayers):
-                    rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i] / self.model.p
-        return mat, rhs
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        if self.type == 'v':
+            iself = self.model.vbcList.index(self)
+            rhs[:,self.model.Ngbc+iself,:] = self.pc[:,np.newaxis] / self.model.p
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        for i,g in enumerate(glist):
+            rhs4[:,:,i,:] = -self.layerscp(g.unitpotentiallayersv,self.xc,self.yc)  # Pretty cool that this works, really
+        return rhs
 
 class HeadEquationNores:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for head-specified conditions. (really written as constant potential element)
         Returns matrix part Nunknowns,Neq,Np, complex
         Returns rhs part Nunknowns,Nvbc,Np, complex
         '''
-        mat = np.empty( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.empty( (self.Nunknowns,Ncol,self.model.Np), 'D' )
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        for e,ieq in blocks:
+            mat4[:,:,ieq:ieq+e.Nunknowns,:] = self.layerscp(e.potinflayersv,self.xc,self.yc)
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0  
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] = e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers)
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                rhs[istart:istart+self.Nlayers,i,:] -= self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers)  # Pretty cool that this works, really
-            if self.type == 'v':
-                iself = self.model.vbcList.index(self)
-                for i in range(self.Nlayers):
-                    rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i] / self.model.p
-        return mat, rhs
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        if self.type == 'v':
+            iself = self.model.vbcList.index(self)
+            rhs[:,self.model.Ngbc+iself,:] = self.pc[:,np.newaxis] / self.model.p
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        for i,g in enumerate(glist):
+            rhs4[:,:,i,:] = -self.layerscp(g.unitpotentiallayersv,self.xc,self.yc)  # Pretty cool that this works, really
+        return rhs
     
 class LeakyWallEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for leaky-wall condition
         Returns matrix part Nunknowns,Neq,Np, complex
         Returns rhs part Nunknowns,Nvbc,Np, complex
         '''
-        mat = np.empty( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.empty( (self.Nunknowns,Ncol,self.model.Np), 'D' )
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        cosout = self.cosout[:,np.newaxis,np.newaxis]; sinout = self.sinout[:,np.newaxis,np.newaxis]
+        for e,ieq in blocks:
+            qx,qy = self.layerscp(e.disinflayersv,self.xc,self.yc)
+            mat4[:,:,ieq:ieq+e.Nunknowns,:] = qx * cosout[:,:,:,np.newaxis] + qy * sinout[:,:,:,np.newaxis]
+            if e == self:
+                hmin = self.layerscp(e.potinflayersv,self.xcneg,self.ycneg) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]
+                hplus = self.layerscp(e.potinflayersv,self.xc,self.yc) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]
+                mat4[:,:,ieq:ieq+e.Nunknowns,:] -= self.resfac[:,np.newaxis,np.newaxis] * (hplus-hmin)
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0  
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    qx,qy = e.disinflayers(self.xc[icp],self.yc[icp],self.pylayers)
-                    mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] = qx * self.cosout[icp] + qy * self.sinout[icp]
-                    if e == self:
-                        hmin = e.potinflayers(self.xcneg[icp],self.ycneg[icp],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]
-                        hplus = e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]
-                        mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] -= self.resfac[:,np.newaxis,np.newaxis] * (hplus-hmin)
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                qx,qy = self.model.gbcList[i].unitdischargelayers(self.xc[icp],self.yc[icp],self.pylayers)
-                rhs[istart:istart+self.Nlayers,i,:] -=  qx * self.cosout[icp] + qy * self.sinout[icp]
-            #if self.type == 'v':
-            #    iself = self.model.vbcList.index(self)
-            #    for i in range(self.Nlayers):
-            #        rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i] / self.model.p
-        return mat, rhs
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        #if self.type == 'v':
+        #    iself = self.model.vbcList.index(self)
+        #    for i in range(self.Nlayers):
+        #        rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i] / self.model.p
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        cosout = self.cosout[:,np.newaxis,np.newaxis]; sinout = self.sinout[:,np.newaxis,np.newaxis]
+        for i,g in enumerate(glist):
+            qx,qy = self.layerscp(g.unitdischargelayersv,self.xc,self.yc)
+            rhs4[:,:,i,:] = -( qx * cosout + qy * sinout )
+        return rhs
     
 class NoflowEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for no-flow condition
         Returns matrix part Nunknowns,Neq,Np, complex
         Returns rhs part Nunknowns,Nvbc,Np, complex
         '''
-        mat = np.empty( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.empty( (self.Nunknowns,Ncol,self.model.Np), 'D' )
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        for e,ieq in blocks:
+            qx,qy = self.layerscp(e.disinflayersv,self.xc,self.yc)
+            mat4[:,:,ieq:ieq+e.Nunknowns,:] = qx * self.cosout + qy * self.sinout
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0  
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    qx,qy = e.disinflayers(self.xc[icp],self.yc[icp],self.pylayers)
-                    mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] = qx * self.cosout + qy * self.sinout
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                qx,qy = self.model.gbcList[i].unitdischargelayers(self.xc[icp],self.yc[icp],self.pylayers)
-                rhs[istart:istart+self.Nlayers,i,:] -=  qx * self.cosout + qy * self.sinout
-            #if self.type == 'v':
-            #    iself = self.model.vbcList.index(self)
-            #    for i in range(self.Nlayers):
-            #        rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i] / self.model.p
-        return mat, rhs
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        #if self.type == 'v':
+        #    iself = self.model.vbcList.index(self)
+        #    for i in range(self.Nlayers):
+        #        rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i] / self.model.p
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        for i,g in enumerate(glist):
+            qx,qy = self.layerscp(g.unitdischargelayersv,self.xc,self.yc)
+            rhs4[:,:,i,:] = -( qx * self.cosout + qy * self.sinout )
+        return rhs
     
 class HeadEquationNew:
     '''Variable Head BC'''
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for head-specified conditions. (really written as constant potential element)
         Works for Nunknowns = 1
         Returns matrix part Nunknowns,Neq,Np, complex
@@ -859,91 +1989,113 @@ class HeadEquationNew:
         Well: q_s = Q / (2*pi*r_w*H)
         LineSink: q_s = sigma / H = Q / (L*H)
         '''
-        mat = np.empty( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.empty( (self.Nunknowns,Ncol,self.model.Np), 'D' )
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        for e,ieq in blocks:
+            mat4[:,:,ieq:ieq+e.Nunknowns,:] = self.layerscp(e.potinflayersv,self.xc,self.yc)
+            if e == self:
+                for i in range(self.Nunknowns): mat[i,ieq+i,:] -= self.resfacp[i] * e.strengthinflayers[i]
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0  
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] = e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers)
-                    if e == self:
-                        for i in range(self.Nlayers): mat[istart+i,ieq+istart+i,:] -= self.resfacp[istart+i] * e.strengthinflayers[istart+i]
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                rhs[istart:istart+self.Nlayers,i,:] -= self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers)  # Pretty cool that this works, really
-            if self.type == 'v':
-                iself = self.model.vbcList.index(self)
-                for i in range(self.Nlayers):
-                    rhs[istart+i,self.model.Ngbc+iself,:] = self.pc[istart+i,:]
-        return mat, rhs
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        if self.type == 'v':
+            iself = self.model.vbcList.index(self)
+            rhs[:,self.model.Ngbc+iself,:] = self.pc
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        for i,g in enumerate(glist):
+            rhs4[:,:,i,:] = -self.layerscp(g.unitpotentiallayersv,self.xc,self.yc)  # Pretty cool that this works, really
+        return rhs
     
 class WellBoreStorageEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for multi-aquifer element with
         total given discharge, uniform but unknown head and InternalStorageEquation
         '''
-        mat = np.zeros( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' ) # Important to set to zero for some of the equations
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.zeros( (self.Nunknowns,Ncol,self.model.Np), 'D' ) # Important to set to zero for some of the equations
+        for e,ieq in blocks:
+            head = e.potinflayers(self.xc,self.yc,self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]
+            mat[:-1,ieq:ieq+e.Nunknowns,:] = head[:-1,:] - head[1:,:]
+            mat[-1,ieq:ieq+e.Nunknowns,:] -= np.pi * self.rc**2 * self.model.p * head[0,:]
+            if e == self:
+                disterm = self.strengthinflayers * self.res / ( 2 * np.pi * self.rw * self.aq.Haq[self.pylayers][:,np.newaxis] )
+                if self.Nunknowns > 1:  # Multiple layers
+                    for i in range(self.Nunknowns-1):
+                        mat[i,ieq+i,:] -= disterm[i]
+                        mat[i,ieq+i+1,:] += disterm[i+1]
+                mat[-1,ieq:ieq+self.Nunknowns,:] += self.strengthinflayers
+                mat[-1,ieq,:] += np.pi * self.rc**2 * self.model.p * disterm[0]
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        ieq = 0
-        for e in self.model.elementList:
-            if e.Nunknowns > 0:
-                head = e.potinflayers(self.xc,self.yc,self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]
-                mat[:-1,ieq:ieq+e.Nunknowns,:] = head[:-1,:] - head[1:,:]
-                mat[-1,ieq:ieq+e.Nunknowns,:] -= np.pi * self.rc**2 * self.model.p * head[0,:]
-                if e == self:
-                    disterm = self.strengthinflayers * self.res / ( 2 * np.pi * self.rw * self.aq.Haq[self.pylayers][:,np.newaxis] )
-                    if self.Nunknowns > 1:  # Multiple layers
-                        for i in range(self.Nunknowns-1):
-                            mat[i,ieq+i,:] -= disterm[i]
-                            mat[i,ieq+i+1,:] += disterm[i+1]
-                    mat[-1,ieq:ieq+self.Nunknowns,:] += self.strengthinflayers
-                    mat[-1,ieq,:] += np.pi * self.rc**2 * self.model.p * disterm[0]
-                ieq += e.Nunknowns
-        for i in range(self.model.Ngbc):
-            head = self.model.gbcList[i].unitpotentiallayers(self.xc,self.yc,self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis]
-            rhs[:-1,i,:] -= head[:-1,:] - head[1:,:]
-            rhs[-1,i,:] += np.pi * self.rc**2 * self.model.p * head[0,:]
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
         if self.type == 'v':
             iself = self.model.vbcList.index(self)
             rhs[-1,self.model.Ngbc+iself,:] += self.flowcoef
-        return mat, rhs
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        for i,g in enumerate(glist):
+            head = g.unitpotentiallayers(self.xc,self.yc,self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis]
+            rhs[:-1,i,:] = -( head[:-1,:] - head[1:,:] )
+            rhs[-1,i,:] = np.pi * self.rc**2 * self.model.p * head[0,:]
+        return rhs
 
 class MscreenEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for multi-screen conditions where total discharge is specified.
         Works for Nunknowns = 1
         Returns matrix part Nunknowns,Neq,Np, complex
         Returns rhs part Nunknowns,Nvbc,Np, complex
         head_out - c*q_s = h_in
         Set h_i - h_(i+1) = 0 and Sum Q_i = Q'''
-        mat = np.zeros( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )  # Needs to be zero for last equation, but I think setting the whole array is quicker
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.zeros( (self.Nunknowns,Ncol,self.model.Np), 'D' )  # Needs to be zero for last equation, but I think setting the whole array is quicker
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        for e,ieq in blocks:
+            head = self.layerscp(e.potinflayersv,self.xc,self.yc) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]  # T[self.pylayers,np.newaxis,np.newaxis] is not allowed
+            mat4[:,:-1,ieq:ieq+e.Nunknowns,:] = head[:,:-1] - head[:,1:]
+            if e == self:
+                for icp in range(self.Ncp):
+                    istart = icp*self.Nlayers
+                    for i in range(self.Nlayers-1):
+                        mat[istart+i,ieq+istart+i,:] -= self.resfach[istart+i] * e.strengthinflayers[istart+i]
+                        mat[istart+i,ieq+istart+i+1,:] += self.resfach[istart+i+1] * e.strengthinflayers[istart+i+1]
+                        mat[istart+i,ieq+istart:ieq+istart+i+1,:] -= self.vresfac[istart+i] * e.strengthinflayers[istart+i]
+                    mat[istart+self.Nlayers-1,ieq+istart:ieq+istart+self.Nlayers,:] = 1.0
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        ieq = 0
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0 
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    head = e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]  # T[self.pylayers,np.newaxis,np.newaxis] is not allowed
-                    mat[istart:istart+self.Nlayers-1,ieq:ieq+e.Nunknowns,:] = head[:-1,:] - head[1:,:]
-                    if e == self:
-                        for i in range(self.Nlayers-1):
-                            mat[istart+i,ieq+istart+i,:] -= self.resfach[istart+i] * e.strengthinflayers[istart+i]
-                            mat[istart+i,ieq+istart+i+1,:] += self.resfach[istart+i+1] * e.strengthinflayers[istart+i+1]
-                            mat[istart+i,ieq+istart:ieq+istart+i+1,:] -= self.vresfac[istart+i] * e.strengthinflayers[istart+i]
-                        mat[istart+self.Nlayers-1,ieq+istart:ieq+istart+self.Nlayers,:] = 1.0
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                head = self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis]
-                rhs[istart:istart+self.Nlayers-1,i,:] -= head[:-1,:] - head[1:,:]
-            if self.type == 'v':
-                iself = self.model.vbcList.index(self)
-                rhs[istart+self.Nlayers-1,self.model.Ngbc+iself,:] = 1.0  # If self.type == 'z', it should sum to zero, which is the default value of rhs
-        return mat, rhs
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,self.model.Ngvbc,self.model.Np)
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        if self.type == 'v':
+            iself = self.model.vbcList.index(self)
+            rhs4[:,-1,self.model.Ngbc+iself,:] = 1.0  # If self.type == 'z', it should sum to zero, which is the default value of rhs
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.zeros( (self.Nunknowns,len(glist),self.model.Np), 'D' )  # Sum of discharges is zero for given elements
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        for i,g in enumerate(glist):
+            head = self.layerscp(g.unitpotentiallayersv,self.xc,self.yc) / self.aq.T[self.pylayers][:,np.newaxis]
+            rhs4[:,:-1,i,:] = -( head[:,:-1] - head[:,1:] )
+        return rhs
     
 class MscreenDitchEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for multi-scren conditions where total discharge is specified.
         Returns matrix part Nunknowns,Neq,Np, complex
         Returns rhs part Nunknowns,Nvbc,Np, complex
@@ -955,89 +2107,105 @@ class MscreenDitchEquation:
         In case of storage:
         Sum Q_i - A * p^2 * headin = Q
         '''
-        mat = np.zeros( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )  # Needs to be zero for last equation, but I think setting the whole array is quicker
-        rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        ieq = 0
-        for icp in range(self.Ncp):
-            istart = icp*self.Nlayers
-            ieq = 0 
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    head = e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]  # T[self.pylayers,np.newaxis,np.newaxis] is not allowed
-                    if self.Nlayers > 1: mat[istart:istart+self.Nlayers-1,ieq:ieq+e.Nunknowns,:] = head[:-1,:] - head[1:,:]
-                    mat[istart+self.Nlayers-1,ieq:ieq+e.Nunknowns,:] = head[0,:] # Store head in top layer in 2nd to last equation of this control point
-                    if e == self:
-                        # Correct head in top layer in second to last equation to make it head inside
-                        mat[istart+self.Nlayers-1,ieq+istart,:] -= self.resfach[istart] * e.strengthinflayers[istart]
-                        if icp == 0:
-                            istartself = ieq  # Needed to build last equation
-                        for i in range(self.Nlayers-1):
-                            mat[istart+i,ieq+istart+i,:] -= self.resfach[istart+i] * e.strengthinflayers[istart+i]
-                            mat[istart+i,ieq+istart+i+1,:] += self.resfach[istart+i+1] * e.strengthinflayers[istart+i+1]
-                            #vresfac not yet used here; it is set to zero ad I don't quite now what is means yet
-                            #mat[istart+i,ieq+istart:ieq+istart+i+1,:] -= self.vresfac[istart+i] * e.strengthinflayers[istart+i]
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                head = self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis]
-                if self.Nlayers > 1: rhs[istart:istart+self.Nlayers-1,i,:] -= head[:-1,:] - head[1:,:]
-                rhs[istart+self.Nlayers-1,i,:] -= head[0,:] # Store minus the head in top layer in second to last equation for this control point
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.zeros( (self.Nunknowns,Ncol,self.model.Np), 'D' )  # Needs to be zero for last equation, but I think setting the whole array is quicker
+        mat4 = mat.reshape(self.Ncp,self.Nlayers,Ncol,self.model.Np)
+        matlast = np.zeros( (Ncol,  self.model.Np), 'D' )  # Used to store last equation in case of ditch storage
+        istartself = None  # Set when self is one of the columns
+        for e,ieq in blocks:
+            head = self.layerscp(e.potinflayersv,self.xc,self.yc) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]  # T[self.pylayers,np.newaxis,np.newaxis] is not allowed
+            if self.Nlayers > 1: mat4[:,:-1,ieq:ieq+e.Nunknowns,:] = head[:,:-1] - head[:,1:]
+            mat4[:,-1,ieq:ieq+e.Nunknowns,:] = head[:,0] # Store head in top layer in 2nd to last equation of this control point
+            matlast[ieq:ieq+e.Nunknowns] -= head[0,0]  # Head in top layer at first control point, for ditch storage
+            if e == self:
+                istartself = ieq  # Needed to build last equation
+                # only need to correct first unknown 
+                matlast[ieq] += self.resfach[0] * e.strengthinflayers[0]
+                for icp in range(self.Ncp):
+                    istart = icp*self.Nlayers
+                    # Correct head in top layer in second to last equation to make it head inside
+                    mat[istart+self.Nlayers-1,ieq+istart,:] -= self.resfach[istart] * e.strengthinflayers[istart]
+                    for i in range(self.Nlayers-1):
+                        mat[istart+i,ieq+istart+i,:] -= self.resfach[istart+i] * e.strengthinflayers[istart+i]
+                        mat[istart+i,ieq+istart+i+1,:] += self.resfach[istart+i+1] * e.strengthinflayers[istart+i+1]
+                        #vresfac not yet used here; it is set to zero ad I don't quite now what is means yet
+                        #mat[istart+i,ieq+istart:ieq+istart+i+1,:] -= self.vresfac[istart+i] * e.strengthinflayers[istart+i]
         # Modify last equations
         for icp in range(self.Ncp-1):
             ieq = (icp+1) * self.Nlayers - 1
             mat[ieq,:,:] -= mat[ieq+self.Nlayers,:,:]  # Head first layer control point icp - Head first layer control point icp + 1
-            rhs[ieq,:,:] -= rhs[ieq+self.Nlayers,:,:]
         # Last equation setting the total discharge of the ditch
         # print 'istartself ',istartself
         mat[-1,:,:] = 0.0  
-        mat[-1,istartself:istartself+self.Nparam,:] = 1.0
+        if istartself is not None: mat[-1,istartself:istartself+self.Nparam,:] = 1.0
         if self.Astorage is not None:
-            matlast = np.zeros( (self.model.Neq,  self.model.Np), 'D' )  # Used to store last equation in case of ditch storage
-            rhslast = np.zeros( (self.model.Np), 'D' )  # Used to store last equation in case of ditch storage 
-            ieq = 0
-            for e in self.model.elementList:
-                head = e.potinflayers(self.xc[0],self.yc[0],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis,np.newaxis]  # T[self.pylayers,np.newaxis,np.newaxis] is not allowed
-                matlast[ieq:ieq+e.Nunknowns] -= self.Astorage * self.model.p**2 * head[0,:]
-                if e == self:
-                    # only need to correct first unknown 
-                    matlast[ieq] += self.Astorage * self.model.p**2 * self.resfach[0] * e.strengthinflayers[0]
-                ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                head = self.model.gbcList[i].unitpotentiallayers(self.xc[0],self.yc[0],self.pylayers) / self.aq.T[self.pylayers][:,np.newaxis]
-                rhslast += self.Astorage * self.model.p**2 * head[0] 
-            mat[-1] += matlast
-        rhs[-1,:,:] = 0.0
+            mat[-1] += self.Astorage * self.model.p**2 * matlast
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
+        rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
         if self.type == 'v':
             iself = self.model.vbcList.index(self)
             rhs[-1,self.model.Ngbc+iself,:] = 1.0  # If self.type == 'z', it should sum to zero, which is the default value of rhs
-            if self.Astorage is not None: rhs[-1,self.model.Ngbc+iself,:] += rhslast
-        return mat, rhs
+            if self.Astorage is not None:
+                # Head of the given elements in top layer at first control point, for ditch storage
+                # Each given element is added once with its unit strength, so the groups of gbcGroupList are not used
+                rhslast = np.sum( [ self.layerscp(g.unitpotentiallayersv,self.xc[:1],self.yc[:1])[0,0] for g in self.model.gbcList ], 0 ) / self.aq.T[self.pylayers[0]]
+                rhs[-1,self.model.Ngbc+iself,:] += self.Astorage * self.model.p**2 * rhslast
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs4 = rhs.reshape(self.Ncp,self.Nlayers,len(glist),self.model.Np)
+        for i,g in enumerate(glist):
+            head = self.layerscp(g.unitpotentiallayersv,self.xc,self.yc) / self.aq.T[self.pylayers][:,np.newaxis]
+            if self.Nlayers > 1: rhs4[:,:-1,i,:] = -( head[:,:-1] - head[:,1:] )
+            rhs4[:,-1,i,:] = -head[:,0] # Store minus the head in top layer in second to last equation for this control point
+        for icp in range(self.Ncp-1):
+            ieq = (icp+1) * self.Nlayers - 1
+            rhs[ieq,:,:] -= rhs[ieq+self.Nlayers,:,:]
+        rhs[-1,:,:] = 0.0
+        return rhs
     
 class InhomEquation:
-    def equation(self):
+    def equation(self,columns=None):
         '''Mix-in class that returns matrix rows for inhomogeneity conditions'''
-        mat = np.empty( (self.Nunknowns,self.model.Neq,self.model.Np), 'D' )
+        blocks,Ncol = self.model.equationblocks(columns)
+        mat = np.empty( (self.Nunknowns,Ncol,self.model.Np), 'D' )
+        # Views with control point, condition (0: head, 1: normal flux) and layer as separate axes
+        mat5 = mat.reshape(self.Ncp,2,self.Nlayers,Ncol,self.model.Np)
+        Tin = self.aqin.T[self.pylayers][:,np.newaxis]; Tout = self.aqout.T[self.pylayers][:,np.newaxis]
+        costheta = np.cos(self.thetacp)[:,np.newaxis,np.newaxis]; sintheta = np.sin(self.thetacp)[:,np.newaxis,np.newaxis]
+        for e,ieq in blocks:
+            mat5[:,0,:,ieq:ieq+e.Nunknowns,:] = \
+            self.layerscp(e.potinflayersv,self.xc,self.yc,self.aqin) / Tin[:,:,np.newaxis] - \
+            self.layerscp(e.potinflayersv,self.xc,self.yc,self.aqout) / Tout[:,:,np.newaxis]
+            qxin,qyin = self.layerscp(e.disinflayersv,self.xc,self.yc,self.aqin)
+            qxout,qyout = self.layerscp(e.disinflayersv,self.xc,self.yc,self.aqout)
+            mat5[:,1,:,ieq:ieq+e.Nunknowns,:] = \
+                (qxin-qxout) * costheta[:,:,:,np.newaxis] + (qyin-qyout) * sintheta[:,:,:,np.newaxis]
+        if columns is not None: return mat, None  # Only the columns of the elements in columns
+        return mat, self.equationrhs()
+    def equationrhs(self):
+        '''Returns rhs part Nunknowns,Ngvbc,Np, complex'''
         rhs = np.zeros( (self.Nunknowns,self.model.Ngvbc,self.model.Np), 'D' )  # Needs to be initialized to zero
-        for icp in range(self.Ncp):
-            istart = icp*2*self.Nlayers
-            ieq = 0  
-            for e in self.model.elementList:
-                if e.Nunknowns > 0:
-                    mat[istart:istart+self.Nlayers,ieq:ieq+e.Nunknowns,:] = \
-                    e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqin) / self.aqin.T[self.pylayers][:,np.newaxis,np.newaxis] - \
-                    e.potinflayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqout) / self.aqout.T[self.pylayers][:,np.newaxis,np.newaxis]
-                    qxin,qyin = e.disinflayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqin)
-                    qxout,qyout = e.disinflayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqout)
-                    mat[istart+self.Nlayers:istart+2*self.Nlayers,ieq:ieq+e.Nunknowns,:] = \
-                        (qxin-qxout) * np.cos(self.thetacp[icp]) + (qyin-qyout) * np.sin(self.thetacp[icp])
-                    ieq += e.Nunknowns
-            for i in range(self.model.Ngbc):
-                rhs[istart:istart+self.Nlayers,i,:] -= \
-                (self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqin)  / self.aqin.T[self.pylayers][:,np.newaxis] - \
-                 self.model.gbcList[i].unitpotentiallayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqout) / self.aqout.T[self.pylayers][:,np.newaxis] )
-                qxin,qyin = self.model.gbcList[i].unitdischargelayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqin)
-                qxout,qyout = self.model.gbcList[i].unitdischargelayers(self.xc[icp],self.yc[icp],self.pylayers,self.aqout)
-                rhs[istart+self.Nlayers:istart+2*self.Nlayers,i,:] -= (qxin-qxout) * np.cos(self.thetacp[icp]) + (qyin-qyout) * np.sin(self.thetacp[icp])
-        return mat, rhs
+        rhs[:,:self.model.Ngbc,:] = self.rhsgiven(self.model.gbcGroupList)
+        return rhs
+    def rhsgiven(self,glist):
+        '''Returns rhs part Nunknowns,len(glist),Np for the given elements or groups in glist'''
+        rhs = np.empty( (self.Nunknowns,len(glist),self.model.Np), 'D' )
+        rhs5 = rhs.reshape(self.Ncp,2,self.Nlayers,len(glist),self.model.Np)
+        Tin = self.aqin.T[self.pylayers][:,np.newaxis]; Tout = self.aqout.T[self.pylayers][:,np.newaxis]
+        costheta = np.cos(self.thetacp)[:,np.newaxis,np.newaxis]; sintheta = np.sin(self.thetacp)[:,np.newaxis,np.newaxis]
+        for i,g in enumerate(glist):
+            rhs5[:,0,:,i,:] = -( self.layerscp(g.unitpotentiallayersv,self.xc,self.yc,self.aqin)  / Tin - \
+                                 self.layerscp(g.unitpotentiallayersv,self.xc,self.yc,self.aqout) / Tout )
+            qxin,qyin = self.layerscp(g.unitdischargelayersv,self.xc,self.yc,self.aqin)
+            qxout,qyout = self.layerscp(g.unitdischargelayersv,self.xc,self.yc,self.aqout)
+            rhs5[:,1,:,i,:] = -( (qxin-qxout) * costheta + (qyin-qyout) * sintheta )
+        return rhs
     
 class BesselRatioApprox:
     # Never fully debugged
@@ -1188,6 +2356,9 @@ class CircInhomRadial(Element,InhomEquation):
             qr.shape = (self.Nparam,aq.Naq,self.model.Np)
             qx[:] = qr * (x-self.x0) / r; qy[:] = qr * (y-self.y0) / r
         return qx,qy
+    def reach(self):
+        d = self.R + self.Rzero * max( self.aqin.lababs.max(), self.aqout.lababs.max() )
+        return self.x0 - d, self.x0 + d, self.y0 - d, self.y0 + d
     def layout(self):
         return 'line', self.x0 + self.R * np.cos(np.linspace(0,2*np.pi,100)), self.y0 + self.R * np.sin(np.linspace(0,2*np.pi,100))
                 
@@ -1350,6 +2521,141 @@ class CircInhom(Element,InhomEquation):
             qx[self.Nparam/2:,:,:] = qr * np.cos(alpha) - qt * np.sin(alpha);
             qy[self.Nparam/2:,:,:] = qr * np.sin(alpha) + qt * np.cos(alpha);            
         return qx,qy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        Npts = len(x)
+        rv = np.zeros((2*aq.Naq,1+2*self.order,aq.Naq,self.model.Nin,self.model.Npin,Npts),'D')
+        if aq == self.aqin:
+            r = np.sqrt( (x-self.x0)**2 + (y-self.y0)**2 )
+            alpha = np.arctan2(y-self.y0, x-self.x0)
+            for i in range(self.aqin.Naq):
+                for j in range(self.model.Nin):
+                    ind = np.nonzero( np.abs(r-self.R) / abs(self.aqin.lab2[i,j,0]) < self.Rzero )[0]
+                    if len(ind) == 0: continue
+                    if self.circ_in_small[i,j]:
+                        rlab = r[ind] / self.aqin.lab2[i,j,:,np.newaxis]
+                        rv[i,0,i,j][:,ind] = iv( 0, rlab ) * self.facin[0,i,j,:,np.newaxis]
+                        for n in range(1,self.order+1):
+                            pot = iv( n, rlab ) * self.facin[n,i,j,:,np.newaxis]
+                            rv[i,2*n-1,i,j][:,ind] = pot * np.cos(n*alpha[ind])
+                            rv[i,2*n  ,i,j][:,ind] = pot * np.sin(n*alpha[ind])
+                    else:
+                        for k in ind:
+                            pot = self.besapprox.ivratio(r[k],self.R,self.aqin.lab2[i,j,:])
+                            rv[i,0,i,j,:,k] = pot[0]
+                            for n in range(1,self.order+1):
+                                rv[i,2*n-1,i,j,:,k] = pot[n] * np.cos(n*alpha[k])
+                                rv[i,2*n  ,i,j,:,k] = pot[n] * np.sin(n*alpha[k])
+        if aq == self.aqout:
+            r = np.sqrt( (x-self.x0)**2 + (y-self.y0)**2 )
+            alpha = np.arctan2(y-self.y0, x-self.x0)
+            for i in range(self.aqout.Naq):
+                for j in range(self.model.Nin):
+                    ind = np.nonzero( np.abs(r-self.R) / abs(self.aqout.lab2[i,j,0]) < self.Rzero )[0]
+                    if len(ind) == 0: continue
+                    if self.circ_out_small[i,j]:
+                        rlab = r[ind] / self.aqout.lab2[i,j,:,np.newaxis]
+                        rv[aq.Naq+i,0,i,j][:,ind] = kv( 0, rlab ) * self.facout[0,i,j,:,np.newaxis]
+                        for n in range(1,self.order+1):
+                            pot = kv( n, rlab ) * self.facout[n,i,j,:,np.newaxis]
+                            rv[aq.Naq+i,2*n-1,i,j][:,ind] = pot * np.cos(n*alpha[ind])
+                            rv[aq.Naq+i,2*n  ,i,j][:,ind] = pot * np.sin(n*alpha[ind])
+                    else:
+                        for k in ind:
+                            pot = self.besapprox.kvratio(r[k],self.R,self.aqout.lab2[i,j,:])
+                            rv[aq.Naq+i,0,i,j,:,k] = pot[0]
+                            for n in range(1,self.order+1):
+                                rv[aq.Naq+i,2*n-1,i,j,:,k] = pot[n] * np.cos(n*alpha[k])
+                                rv[aq.Naq+i,2*n  ,i,j,:,k] = pot[n] * np.sin(n*alpha[k])
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,Npts)
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        Npts = len(x)
+        qx = np.zeros((self.Nparam,aq.Naq,self.model.Np,Npts),'D')
+        qy = np.zeros((self.Nparam,aq.Naq,self.model.Np,Npts),'D')
+        if aq == self.aqin:
+            r = np.sqrt( (x-self.x0)**2 + (y-self.y0)**2 )
+            alpha = np.arctan2(y-self.y0, x-self.x0)
+            qr = np.zeros((aq.Naq,1+2*self.order,aq.Naq,self.model.Nin,self.model.Npin,Npts),'D')
+            qt = np.zeros((aq.Naq,1+2*self.order,aq.Naq,self.model.Nin,self.model.Npin,Npts),'D')
+            r[r < 1e-20] = 1e-20  # As we divide by that on the return
+            for i in range(self.aqin.Naq):
+                for j in range(self.model.Nin):
+                    ind = np.nonzero( np.abs(r-self.R) / abs(self.aqin.lab2[i,j,0]) < self.Rzero )[0]
+                    if len(ind) == 0: continue
+                    lab = self.aqin.lab2[i,j,:,np.newaxis]
+                    if self.circ_in_small[i,j]:
+                        rr = r[ind]; a = alpha[ind]
+                        pot = np.zeros((self.order+2,self.model.Npin,len(ind)),'D')
+                        for n in range(self.order+2):
+                            pot[n] = iv( n, rr / lab )
+                        qr[i,0,i,j][:,ind] = -pot[1] / lab * self.facin[0,i,j,:,np.newaxis]
+                        for n in range(1,self.order+1):
+                            fac = self.facin[n,i,j,:,np.newaxis]
+                            qr[i,2*n-1,i,j][:,ind] = -(pot[n-1] + pot[n+1]) / 2 / lab * np.cos(n*a) * fac
+                            qr[i,2*n  ,i,j][:,ind] = -(pot[n-1] + pot[n+1]) / 2 / lab * np.sin(n*a) * fac
+                            qt[i,2*n-1,i,j][:,ind] =   pot[n] * np.sin(n*a) * n / rr * fac
+                            qt[i,2*n  ,i,j][:,ind] =  -pot[n] * np.cos(n*a) * n / rr * fac
+                    else:
+                        for k in ind:
+                            pot  = self.besapprox.ivratio(r[k],self.R,self.aqin.lab2[i,j,:])
+                            potp = self.besapprox.ivratiop(r[k],self.R,self.aqin.lab2[i,j,:])
+                            qr[i,0,i,j,:,k] = -potp[0] / self.aqin.lab2[i,j,:]
+                            for n in range(1,self.order+1):
+                                qr[i,2*n-1,i,j,:,k] = -potp[n] / self.aqin.lab2[i,j,:] * np.cos(n*alpha[k])
+                                qr[i,2*n  ,i,j,:,k] = -potp[n] / 2 / self.aqin.lab2[i,j,:] * np.sin(n*alpha[k])
+                                qt[i,2*n-1,i,j,:,k] =  pot[n] * np.sin(n*alpha[k]) * n / r[k]
+                                qt[i,2*n  ,i,j,:,k] = -pot[n] * np.cos(n*alpha[k]) * n / r[k]
+            qr.shape = (self.Nparam/2,aq.Naq,self.model.Np,Npts)
+            qt.shape = (self.Nparam/2,aq.Naq,self.model.Np,Npts)
+            qx[:self.Nparam/2] = qr * np.cos(alpha) - qt * np.sin(alpha)
+            qy[:self.Nparam/2] = qr * np.sin(alpha) + qt * np.cos(alpha)
+        if aq == self.aqout:
+            r = np.sqrt( (x-self.x0)**2 + (y-self.y0)**2 )
+            alpha = np.arctan2(y-self.y0, x-self.x0)
+            qr = np.zeros((aq.Naq,1+2*self.order,aq.Naq,self.model.Nin,self.model.Npin,Npts),'D')
+            qt = np.zeros((aq.Naq,1+2*self.order,aq.Naq,self.model.Nin,self.model.Npin,Npts),'D')
+            r[r < 1e-20] = 1e-20  # As we divide by that on the return
+            for i in range(self.aqout.Naq):
+                for j in range(self.model.Nin):
+                    ind = np.nonzero( np.abs(r-self.R) / abs(self.aqout.lab2[i,j,0]) < self.Rzero )[0]
+                    if len(ind) == 0: continue
+                    lab = self.aqout.lab2[i,j,:,np.newaxis]
+                    if self.circ_out_small[i,j]:
+                        rr = r[ind]; a = alpha[ind]
+                        pot = np.zeros((self.order+2,self.model.Npin,len(ind)),'D')
+                        for n in range(self.order+2):
+                            pot[n] = kv( n, rr / lab )
+                        qr[i,0,i,j][:,ind] = pot[1] / lab * self.facout[0,i,j,:,np.newaxis]
+                        for n in range(1,self.order+1):
+                            fac = self.facout[n,i,j,:,np.newaxis]
+                            qr[i,2*n-1,i,j][:,ind] = (pot[n-1] + pot[n+1]) / 2 / lab * np.cos(n*a) * fac
+                            qr[i,2*n  ,i,j][:,ind] = (pot[n-1] + pot[n+1]) / 2 / lab * np.sin(n*a) * fac
+                            qt[i,2*n-1,i,j][:,ind] =   pot[n] * np.sin(n*a) * n / rr * fac
+                            qt[i,2*n  ,i,j][:,ind] =  -pot[n] * np.cos(n*a) * n / rr * fac
+                    else:
+                        for k in ind:
+                            pot  = self.besapprox.kvratio(r[k],self.R,self.aqout.lab2[i,j,:])
+                            potp = self.besapprox.kvratiop(r[k],self.R,self.aqout.lab2[i,j,:])
+                            qr[i,0,i,j,:,k] = -potp[0] / self.aqout.lab2[i,j,:]
+                            for n in range(1,self.order+1):
+                                qr[i,2*n-1,i,j,:,k] = -potp[n] / self.aqout.lab2[i,j,:] * np.cos(n*alpha[k])
+                                qr[i,2*n  ,i,j,:,k] = -potp[n] / self.aqout.lab2[i,j,:] * np.sin(n*alpha[k])
+                                qt[i,2*n-1,i,j,:,k] =  pot[n] * np.sin(n*alpha[k]) * n / r[k]
+                                qt[i,2*n  ,i,j,:,k] = -pot[n] * np.cos(n*alpha[k]) * n / r[k]
+            qr.shape = (self.Nparam/2,aq.Naq,self.model.Np,Npts)
+            qt.shape = (self.Nparam/2,aq.Naq,self.model.Np,Npts)
+            qx[self.Nparam/2:] = qr * np.cos(alpha) - qt * np.sin(alpha)
+            qy[self.Nparam/2:] = qr * np.sin(alpha) + qt * np.cos(alpha)
+        return qx,qy
+    def reach(self):
+        d = self.R + self.Rzero * max( self.aqin.lababs.max(), self.aqout.lababs.max() )
+        return self.x0 - d, self.x0 + d, self.y0 - d, self.y0 + d
     def layout(self):
         return 'line', self.x0 + self.R * np.cos(np.linspace(0,2*np.pi,100)), self.y0 + self.R * np.sin(np.linspace(0,2*np.pi,100))
 
@@ -1480,6 +2786,64 @@ class EllipseInhom(Element,InhomEquation):
             qx[self.Nparam/2:,:,:] = factor * ( qeta * cosangle - qpsi * sinangle )
             qy[self.Nparam/2:,:,:] = factor * ( qeta * sinangle + qpsi * cosangle )        
         return qx,qy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        Npts = len(x)
+        rv = np.zeros((2*aq.Naq,1+2*self.order,aq.Naq,self.model.Np,Npts),'D')
+        shape_even, shape_odd = (len(self.norder),Npts), (self.order,Npts)
+        if aq == self.aqin:
+            eta,psi = self.xytoetapsi(x,y)
+            for i in range(self.aqin.Naq):
+                for j in range(self.model.Np):
+                    mf = self.mfin[i][j]
+                    rv[i,self.neven,i,j] = mf.ce(self.norder,psi).reshape(shape_even) * mf.Ie(self.norder,eta).reshape(shape_even)
+                    if self.order > 0:
+                        rv[i,self.nodd ,i,j] = mf.se(self.norder[1:],psi).reshape(shape_odd) * mf.Io(self.norder[1:],eta).reshape(shape_odd)
+        if aq == self.aqout:
+            eta,psi = self.xytoetapsi(x,y)
+            for i in range(self.aqout.Naq):
+                for j in range(self.model.Np):
+                    mf = self.mfout[i][j]
+                    rv[aq.Naq+i,self.neven,i,j] = mf.ce(self.norder,psi).reshape(shape_even) * mf.Ke(self.norder,eta).reshape(shape_even)
+                    if self.order > 0:
+                        rv[aq.Naq+i,self.nodd ,i,j] = mf.se(self.norder[1:],psi).reshape(shape_odd) * mf.Ko(self.norder[1:],eta).reshape(shape_odd)
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,Npts)
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        Npts = len(x)
+        qx = np.zeros((self.Nparam,aq.Naq,self.model.Np,Npts),'D')
+        qy = np.zeros((self.Nparam,aq.Naq,self.model.Np,Npts),'D')
+        shape_even, shape_odd = (len(self.norder),Npts), (self.order,Npts)
+        for aqcheck,mflist,half in [(self.aqin,self.mfin,0),(self.aqout,self.mfout,1)]:
+            if aq != aqcheck: continue
+            eta,psi = self.xytoetapsi(x,y)
+            qeta = np.zeros((aq.Naq,1+2*self.order,aq.Naq,self.model.Np,Npts),'D')
+            qpsi = np.zeros((aq.Naq,1+2*self.order,aq.Naq,self.model.Np,Npts),'D')
+            for i in range(self.aqin.Naq):
+                for j in range(self.model.Np):
+                    mf = mflist[i][j]
+                    if half == 0:
+                        radeven, radodd, dradeven, dradodd = mf.Ie, mf.Io, mf.dIe, mf.dIo
+                    else:
+                        radeven, radodd, dradeven, dradodd = mf.Ke, mf.Ko, mf.dKe, mf.dKo
+                    qeta[i,self.neven,i,j] = mf.ce(self.norder,psi).reshape(shape_even) * dradeven(self.norder,eta).reshape(shape_even)
+                    qpsi[i,self.neven,i,j] = mf.dce(self.norder,psi).reshape(shape_even) * radeven(self.norder,eta).reshape(shape_even)
+                    if self.order > 0:
+                        qeta[i,self.nodd ,i,j] = mf.se(self.norder[1:],psi).reshape(shape_odd) * dradodd(self.norder[1:],eta).reshape(shape_odd)
+                        qpsi[i,self.nodd ,i,j] = mf.dse(self.norder[1:],psi).reshape(shape_odd) * radodd(self.norder[1:],eta).reshape(shape_odd)
+            qeta.shape = (self.Nparam/2,aq.Naq,self.model.Np,Npts)
+            qpsi.shape = (self.Nparam/2,aq.Naq,self.model.Np,Npts)
+            factor = -1.0 / ( self.afoc * np.sqrt( np.cosh(eta)**2 - np.cos(psi)**2 ) )
+            cosangle,sinangle = self.aqin.outwardnormal(x,y)
+            istart = half * self.Nparam/2
+            qx[istart:istart+self.Nparam/2] = factor * ( qeta * cosangle - qpsi * sinangle )
+            qy[istart:istart+self.Nparam/2] = factor * ( qeta * sinangle + qpsi * cosangle )
+        return qx,qy
     def layout(self):
         theta = arange(0,2*pi+0.001,pi/50)
         return [ list( self.etapsitoxy(self.etastar,theta)[0] ), list( self.etapsitoxy(self.etastar,theta)[1] ) ]
@@ -1545,9 +2909,48 @@ class WellBase(Element):
             qr.shape = (self.Nparam,aq.Naq,self.model.Np)
             qx[:] = qr * (x-self.xw) / r; qy[:] = qr * (y-self.yw) / r
         return qx,qy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            r = np.sqrt( (x-self.xw)**2 + (y-self.yw)**2 )
+            r[r < self.rw] = self.rw  # If at well, set to at radius
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    ind = np.nonzero( r / abs(self.aq.lab2[i,j,0]) < self.Rzero )[0]
+                    if len(ind) > 0:
+                        z = np.ravel( r[ind,np.newaxis] / self.aq.lab2[i,j,:] )
+                        pot = np.zeros(len(z),'D')
+                        bessel.k0besselv( z, pot )
+                        pot.shape = (len(ind),self.model.Npin)
+                        rv[:,i,j][:,:,ind] = self.term2[:,i,j,:,np.newaxis] * pot.T
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D'), np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        if aq == self.aq:
+            qr = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+            r = np.sqrt( (x-self.xw)**2 + (y-self.yw)**2 )
+            r[r < self.rw] = self.rw  # If at well, set to at radius
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    ind = np.nonzero( r / abs(self.aq.lab2[i,j,0]) < self.Rzero )[0]
+                    if len(ind) > 0:
+                        qr[:,i,j][:,:,ind] = self.term2[:,i,j,:,np.newaxis] * kv(1, r[ind] / self.aq.lab2[i,j,:,np.newaxis]) / self.aq.lab2[i,j,:,np.newaxis]
+            qr.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+            qx[:] = qr * (x-self.xw) / r; qy[:] = qr * (y-self.yw) / r
+        return qx,qy
     def headinside(self,t,derivative=0):
         '''Returns head inside the well for the layers that the well is screened in'''
         return self.model.head(self.xc,self.yc,t,derivative=derivative)[self.pylayers] - self.resfach[:,np.newaxis] * self.strength(t,derivative=derivative)
+    def reach(self):
+        d = self.rw + self.Rzero * self.aq.lababs.max()
+        return self.xw - d, self.xw + d, self.yw - d, self.yw + d
     def layout(self):
         return 'point',self.xw,self.yw
 
@@ -1558,7 +2961,6 @@ class LineSinkBase(Element):
         self.Nparam = len(self.pylayers)
         self.x1 = float(x1); self.y1 = float(y1); self.x2 = float(x2); self.y2 = float(y2); self.res = res; self.wh = wh
         if addtomodel: self.model.addElement(self)
-        self.xa,self.ya,self.xb,self.yb,self.np = np.zeros(1),np.zeros(1),np.zeros(1),np.zeros(1),np.zeros(1,'i')  # needed to call bessel.circle_line_intersection
     def __repr__(self):
         return self.name + ' from ' + str((self.x1,self.y1)) +' to '+str((self.x2,self.y2))
     def initialize(self):
@@ -1591,14 +2993,12 @@ class LineSinkBase(Element):
         if aq is None: aq = self.model.aq.findAquiferData( x, y )
         rv = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin),'D')
         if aq == self.aq:
-            pot = np.zeros(self.model.Npin,'D')
+            # The one-point version of potinfv, which uses no scratch arrays stored in the element, so that it is thread-safe
+            xp,yp = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
             for i in range(self.aq.Naq):
                 for j in range(self.model.Nin):
-                    bessel.circle_line_intersection(self.z1,self.z2,x+y*1j,self.Rzero*abs(self.model.aq.lab2[i,j,0]),self.xa,self.ya,self.xb,self.yb,self.np)
-                    if self.np > 0:
-                        za = complex(self.xa,self.ya); zb = complex(self.xb,self.yb) # f2py has problem returning complex arrays -> fixed in new numpy
-                        bessel.bessellsuniv(x,y,za,zb,self.aq.lab2[i,j,:],pot)
-                        rv[:,i,j,:] = self.term2[:,i,j,:] * pot / self.L  # Divide by L as the parameter is now total discharge
+                    pot = bessel.bessellsunivpts(xp,yp,self.z1,self.z2,self.aq.lab2[i,j,:],self.Rzero*abs(self.model.aq.lab2[i,j,0]))[:,0]
+                    rv[:,i,j,:] = self.term2[:,i,j,:] * pot / self.L  # Divide by L as the parameter is now total discharge
         rv.shape = (self.Nparam,aq.Naq,self.model.Np)
         return rv
     def disinf(self,x,y,aq=None):
@@ -1616,8 +3016,37 @@ class LineSinkBase(Element):
         rvx.shape = (self.Nparam,aq.Naq,self.model.Np)
         rvy.shape = (self.Nparam,aq.Naq,self.model.Np)
         return rvx,rvy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    pot = bessel.bessellsunivpts(x,y,self.z1,self.z2,self.aq.lab2[i,j,:],self.Rzero*abs(self.model.aq.lab2[i,j,0]))
+                    rv[:,i,j] = self.term2[:,i,j,:,np.newaxis] * pot / self.L  # Divide by L as the parameter is now total discharge
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rvx,rvy = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D'), np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    qxqy = bessel.bessellsqxqyv2pts(x,y,self.z1,self.z2,self.aq.lab2[i,j,:],self.order,self.Rzero*self.aq.lababs[i,j]) / self.L  # Divide by L as the parameter is now total discharge
+                    rvx[:,i,j] = self.term2[:,i,j,:,np.newaxis] * qxqy[0]
+                    rvy[:,i,j] = self.term2[:,i,j,:,np.newaxis] * qxqy[1]
+        rvx.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        rvy.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rvx,rvy
     def headinside(self,t):
         return self.model.head(self.xc,self.yc,t)[self.pylayers] - self.resfach[:,np.newaxis] * self.strength(t)
+    def reach(self):
+        d = self.Rzero * max( self.aq.lababs.max(), self.model.aq.lababs.max() )  # potinf uses lab of the background aquifer
+        return min(self.x1,self.x2) - d, max(self.x1,self.x2) + d, min(self.y1,self.y2) - d, max(self.y1,self.y2) + d
     def layout(self):
         return 'line', [self.x1,self.x2], [self.y1,self.y2]
         
@@ -1687,6 +3116,47 @@ class CircAreaSink(Element):
             qr.shape = (self.Nparam,aq.Naq,self.model.Np)
             qx[:] = qr * (x-self.xc) / r; qy[:] = qr * (y-self.yc) / r
         return qx,qy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            r = np.sqrt( (x-self.xc)**2 + (y-self.yc)**2 )
+            inside = np.nonzero(r < self.R)[0]
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    lab = self.aq.lab2[i,j,:,np.newaxis]
+                    if len(inside) > 0:
+                        rv[0,i,j][:,inside] = -self.termin[i,j,:,np.newaxis] * iv(0,r[inside]/lab) + self.termin2[i,j,:,np.newaxis]
+                    outside = np.nonzero( (r >= self.R) & ((r-self.R) / abs(self.aq.lab2[i,j,0]) < self.Rzero) )[0]
+                    if len(outside) > 0:
+                        rv[0,i,j][:,outside] = self.termout[i,j,:,np.newaxis] * kv(0,r[outside]/lab)
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        qx,qy = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D'), np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        if aq == self.aq:
+            qr = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+            r = np.sqrt( (x-self.xc)**2 + (y-self.yc)**2 )
+            inside = np.nonzero(r < self.R)[0]
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    lab = self.aq.lab2[i,j,:,np.newaxis]
+                    if len(inside) > 0:
+                        qr[0,i,j][:,inside] = self.terminq[i,j,:,np.newaxis] * iv(1,r[inside]/lab)
+                    outside = np.nonzero( (r >= self.R) & ((r-self.R) / abs(self.aq.lab2[i,j,0]) < self.Rzero) )[0]
+                    if len(outside) > 0:
+                        qr[0,i,j][:,outside] = self.termoutq[i,j,:,np.newaxis] * kv(1,r[outside]/lab)
+            qr.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+            qx[:] = qr * (x-self.xc) / r; qy[:] = qr * (y-self.yc) / r
+        return qx,qy
+    def reach(self):
+        d = self.R + self.Rzero * self.aq.lababs.max()
+        return self.xc - d, self.xc + d, self.yc - d, self.yc + d
     def layout(self):
         return 'line', self.xc + self.R*np.cos(np.linspace(0,2*np.pi,100)), self.xc + self.R*np.sin(np.linspace(0,2*np.pi,100))
         
@@ -1765,8 +3235,39 @@ class LineSinkHoBase(Element):
         rvx.shape = (self.Nparam,aq.Naq,self.model.Np)
         rvy.shape = (self.Nparam,aq.Naq,self.model.Np)
         return rvx,rvy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    pot = bessel.bessellsv2pts(x,y,self.z1,self.z2,self.aq.lab2[i,j,:],self.order,self.Rzero*self.aq.lababs[i,j]) / self.L  # Divide by L as the parameter is now total discharge
+                    for k in range(self.Nlayers):
+                        rv[k::self.Nlayers,i,j] = self.term2[k,i,j,:,np.newaxis] * pot
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rvx,rvy = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D'), np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    qxqy = bessel.bessellsqxqyv2pts(x,y,self.z1,self.z2,self.aq.lab2[i,j,:],self.order,self.Rzero*self.aq.lababs[i,j]) / self.L  # Divide by L as the parameter is now total discharge
+                    for k in range(self.Nlayers):
+                        rvx[k::self.Nlayers,i,j] = self.term2[k,i,j,:,np.newaxis] * qxqy[:self.order+1]
+                        rvy[k::self.Nlayers,i,j] = self.term2[k,i,j,:,np.newaxis] * qxqy[self.order+1:]
+        rvx.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        rvy.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rvx,rvy
     def headinside(self,t):
         return self.model.head(self.xc,self.yc,t)[self.pylayers] - self.resfach[:,np.newaxis] * self.strength(t)
+    def reach(self):
+        d = self.Rzero * self.aq.lababs.max()
+        return min(self.x1,self.x2) - d, max(self.x1,self.x2) + d, min(self.y1,self.y2) - d, max(self.y1,self.y2) + d
     def layout(self):
         return 'line', [self.x1,self.x2], [self.y1,self.y2]
         
@@ -1845,6 +3346,37 @@ class LineDoubletHoBase(Element):
         rvx.shape = (self.Nparam,aq.Naq,self.model.Np)
         rvy.shape = (self.Nparam,aq.Naq,self.model.Np)
         return rvx,rvy
+    def potinfv(self,x,y,aq=None):
+        '''Returns complex array of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    pot = bessel.besselldv2pts(x,y,self.z1,self.z2,self.aq.lab2[i,j,:],self.order,self.Rzero*self.aq.lababs[i,j]) / self.L  # Divide by L as the parameter is now total discharge
+                    for k in range(self.Nlayers):
+                        rv[k::self.Nlayers,i,j] = self.term2[k,i,j,:,np.newaxis] * pot
+        rv.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 complex arrays of size (Nparam,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x).astype('d'), np.atleast_1d(y).astype('d')
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rvx,rvy = np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D'), np.zeros((self.Nparam,aq.Naq,self.model.Nin,self.model.Npin,len(x)),'D')
+        if aq == self.aq:
+            for i in range(self.aq.Naq):
+                for j in range(self.model.Nin):
+                    qxqy = bessel.besselldqxqyv2pts(x,y,self.z1,self.z2,self.aq.lab2[i,j,:],self.order,self.Rzero*self.aq.lababs[i,j]) / self.L  # Divide by L as the parameter is now total discharge
+                    for k in range(self.Nlayers):
+                        rvx[k::self.Nlayers,i,j] = self.term2[k,i,j,:,np.newaxis] * qxqy[:self.order+1]
+                        rvy[k::self.Nlayers,i,j] = self.term2[k,i,j,:,np.newaxis] * qxqy[self.order+1:]
+        rvx.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        rvy.shape = (self.Nparam,aq.Naq,self.model.Np,len(x))
+        return rvx,rvy
+    def reach(self):
+        d = self.Rzero * self.aq.lababs.max()
+        return min(self.x1,self.x2) - d, max(self.x1,self.x2) + d, min(self.y1,self.y2) - d, max(self.y1,self.y2) + d
     def layout(self):
         return 'line', [self.x1,self.x2], [self.y1,self.y2]
     
@@ -2025,6 +3557,12 @@ class LineSinkStringBase(Element):
         self.lsList = []
     def __repr__(self):
         return self.name + ' with nodes ' + str(zip(self.x,self.y))
+    def set(self,**kwargs):
+        '''Attributes are also set for the line-sinks of the string that have them, for example res'''
+        Element.set(self,**kwargs)
+        for ls in self.lsList:
+            for key,value in kwargs.items():
+                if hasattr(ls,key): setattr(ls,key,value)
     def initialize(self):
         self.Ncp = self.Nls
         self.Nparam = self.Nlayers * self.Nls
@@ -2069,17 +3607,37 @@ class LineSinkStringBase(Element):
             rvx[i*self.Nlayers:(i+1)*self.Nlayers,:] = qx
             rvy[i*self.Nlayers:(i+1)*self.Nlayers,:] = qy
         return rvx,rvy
+    def potinfv(self,x,y,aq=None):
+        '''Returns array (Nunknowns,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        for i in range(self.Nls):
+            rv[i*self.Nlayers:(i+1)*self.Nlayers,:] = self.lsList[i].potinfv(x,y,aq)
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 arrays (Nunknowns,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rvx,rvy = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D'),np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        for i in range(self.Nls):
+            qx,qy = self.lsList[i].disinfv(x,y,aq)
+            rvx[i*self.Nlayers:(i+1)*self.Nlayers,:] = qx
+            rvy[i*self.Nlayers:(i+1)*self.Nlayers,:] = qy
+        return rvx,rvy
     def headinside(self,t,derivative=0):
         rv = np.zeros((self.Nls,self.Nlayers,np.size(t)))
         Q = self.strength_list(t,derivative=derivative)
         for i in range(self.Nls):
             rv[i,:,:] = self.model.head(self.xc[i],self.yc[i],t,derivative=derivative)[self.pylayers] - self.resfach[i*self.Nlayers:(i+1)*self.Nlayers,np.newaxis] * Q[i]
         return rv
+    def reach(self):
+        return unionbox([ ls.reach() for ls in self.lsList ])
     def layout(self):
         return 'line', self.xlslayout, self.ylslayout
     def run_after_solve(self):
         for i in range(self.Nls):
-            self.lsList[i].parameters[:] = self.parameters[:,i*self.Nlayers:(i+1)*self.Nlayers,:]
+            self.lsList[i].parameters = self.parameters[:,i*self.Nlayers:(i+1)*self.Nlayers,:].copy()  # Number of columns may change after solve
     def strength_list(self,t,derivative=0):
         # conveniently using the strength functions of the individual line-sinks
         rv = np.zeros((self.Nls,self.Nlayers,np.size(t)))
@@ -2229,15 +3787,32 @@ class LeakyLineDoubletString(Element,LeakyWallEquation):
             rvx[i*ld.Nparam:(i+1)*ld.Nparam,:] = qx
             rvy[i*ld.Nparam:(i+1)*ld.Nparam,:] = qy
         return rvx,rvy
+    def potinfv(self,x,y,aq=None):
+        '''Returns array (Nunknowns,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rv = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        for i,ld in enumerate(self.ldList):
+            rv[i*ld.Nparam:(i+1)*ld.Nparam,:] = ld.potinfv(x,y,aq)
+        return rv
+    def disinfv(self,x,y,aq=None):
+        '''Returns 2 arrays (Nunknowns,Naq,Np,Npts)'''
+        x,y = np.atleast_1d(x), np.atleast_1d(y)
+        if aq is None: aq = self.model.aq.findAquiferData(x[0],y[0])
+        rvx,rvy = np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D'),np.zeros((self.Nparam,aq.Naq,self.model.Np,len(x)),'D')
+        for i,ld in enumerate(self.ldList):
+            qx,qy = ld.disinfv(x,y,aq)
+            rvx[i*ld.Nparam:(i+1)*ld.Nparam,:] = qx
+            rvy[i*ld.Nparam:(i+1)*ld.Nparam,:] = qy
+        return rvx,rvy
+    def reach(self):
+        return unionbox([ ld.reach() for ld in self.ldList ])
     def layout(self):
         return 'line', self.xldlayout, self.yldlayout
     
 def xsection(ml,x1=0,x2=1,y1=0,y2=0,N=100,t=1,layers=1,color=None,lw=1,newfig=True):
     if newfig: plt.figure()
-    x = np.linspace(x1,x2,N)
-    y = np.linspace(y1,y2,N)
-    s = np.sqrt( (x-x[0])**2 + (y-y[0])**2 )
-    h = ml.headalongline(x,y,t,layers)
+    s,x,y,h = ml.headalongpolyline([(x1,y1),(x2,y2)],np.hypot(x2-x1,y2-y1)/(N-1),t,layers)
     Nlayers,Ntime,Nx = h.shape
     for i in range(Nlayers):
         for j in range(Ntime):
@@ -2249,10 +3824,10 @@ def xsection(ml,x1=0,x2=1,y1=0,y2=0,N=100,t=1,layers=1,color=None,lw=1,newfig=Tr
                 
 def timcontour( ml, xmin, xmax, nx, ymin, ymax, ny, levels = 10, t=0.0, layers = 1,\
                color = 'k', lw = 0.5, style = 'solid',layout = True, newfig = True, \
-               labels = False, labelfmt = '%1.2f'):
+               labels = False, labelfmt = '%1.2f', workers = 1):
     '''Contour heads with pylab'''
     print 'grid of '+str((nx,ny))+'. gridding in progress. hit ctrl-c to abort'
-    h = ml.headgrid(xmin,xmax,nx,ymin,ymax,ny,t,layers)  # h[Nlayers,Ntimes,Ny,Nx]
+    h = ml.headgrid(xmin,xmax,nx,ymin,ymax,ny,t,layers,workers=workers)  # h[Nlayers,Ntimes,Ny,Nx]
     xg, yg = np.linspace(xmin,xmax,nx), np.linspace(ymin,ymax,ny)
     Nlayers, Ntimes = h.shape[0:2]
     # Contour
@@ -2301,14 +3876,9 @@ def pyvertcontour( ml, xmin, xmax, ymin, ymax, nx, zg, levels = 10, t=0.0,\
     '''Contours head with pylab'''
     plt.rcParams['contour.negative_linestyle']='solid'
     # Compute grid
-    xg = np.linspace(xmin,xmax,nx)
-    yg = np.linspace(ymin,ymax,nx)
-    sg = np.sqrt((xg-xg[0])**2 + (yg-yg[0])**2)
     print 'gridding in progress. hit ctrl-c to abort'
-    pot = np.zeros( ( ml.aq.Naq, nx ), 'd' )
-    t = np.atleast_1d(t)
-    for ip in range(nx):
-        pot[:,ip] = ml.head(xg[ip], yg[ip], t)[:,0]
+    sg,xg,yg,h = ml.headalongpolyline([(xmin,ymin),(xmax,ymax)],np.hypot(xmax-xmin,ymax-ymin)/(nx-1),np.atleast_1d(t)[:1])
+    pot = h[:,0,:]
     # Contour
     if type(levels) is list:
         levels = np.arange( levels[0],levels[1],levels[2] )